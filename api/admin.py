@@ -151,3 +151,48 @@ class AdminSectionEvent(admin.ModelAdmin):
     list_filter = ("is_active", "datetime")
     fields = ("section", "title", "level", "datetime", "place")
     actions = None
+
+
+@admin.register(AttendanceChange)
+class AdminAttendanceChange(admin.ModelAdmin):
+    list_display = ("id", "user", "training", "event", "action", "is_applied", "happened_at")
+    list_display_links = ("id", "user")
+    list_filter = ("action", "is_applied", "created_at")
+    readonly_fields = ("client_id", "user", "training", "event", "action", "is_applied", "happened_at", "created_at")
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RatingEntry)
+class AdminRatingEntry(admin.ModelAdmin):
+    list_display = ("id", "user", "section", "source", "points", "created_at")
+    list_display_links = ("id", "user")
+    list_filter = ("source", "created_at")
+    readonly_fields = ("user", "section", "source", "training", "event", "points", "created_at")
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OutboxEmail)
+class AdminOutboxEmail(admin.ModelAdmin):
+    list_display = ("id", "key", "status", "attempts", "created_at", "sent_at")
+    list_display_links = ("id", "key")
+    list_filter = ("status", "created_at")
+    readonly_fields = (
+        "key", "email_class", "to", "context", "status", "attempts",
+        "next_attempt_at", "last_error", "created_at", "sent_at"
+    )
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
@@ -6,4 +6,5 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self) -> None:
-        import api.signals
\ No newline at end of file
+        import api.signals
+        import sporthack.db
\ No newline at end of file
@@ -0,0 +1,169 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import Student, SectionTraining, SectionEvent, TrainingMember, EventMember, AttendanceChange
+
+CHANGES_LIMIT = 1000
+
+MEMBER_MODELS = {
+    "training": TrainingMember,
+    "event": EventMember,
+}
+
+
+def record_changes(action, users, training=None, event=None):
+    """Write changes made on server side to the journal,
+    so they are returned to clients by sync"""
+    AttendanceChange.objects.bulk_create([
+        AttendanceChange(action=action, user_id=user, training_id=training, event_id=event)
+        for user in users
+    ])
+
+
+def _resolve(trainer, operations):
+    """Map trainings uuids to ids and drop operations on unknown objects
+    and on objects of sections, which are not trained by `trainer`.
+    Returns list of (operation, target kind, target id) and rejected operations"""
+    sections = set(trainer.sections.values_list("id", flat=True))
+    trainings = {
+        uuid: (pk, section)
+        for uuid, pk, section in (
+            SectionTraining.objects
+            .filter(uuid__in={op["training"] for op in operations if op.get("training")})
+            .values_list("uuid", "id", "section")
+        )
+    }
+    events = dict(
+        SectionEvent.objects
+        .filter(id__in={op["event"] for op in operations if op.get("event")})
+        .values_list("id", "section")
+    )
+    students = set(
+        Student.objects
+        .filter(id__in={op["user"] for op in operations})
+        .values_list("id", flat=True)
+    )
+
+    resolved, rejected = [], []
+    for op in operations:
+        if op["user"] not in students:
+            rejected.append({"id": op["id"], "error": "student_not_found"})
+        elif op.get("training"):
+            if op["training"] not in trainings:
+                rejected.append({"id": op["id"], "error": "training_not_found"})
+            elif trainings[op["training"]][1] not in sections:
+                rejected.append({"id": op["id"], "error": "forbidden"})
+            else:
+                resolved.append((op, "training", trainings[op["training"]][0]))
+        elif op["event"] not in events:
+            rejected.append({"id": op["id"], "error": "event_not_found"})
+        elif events[op["event"]] not in sections:
+            rejected.append({"id": op["id"], "error": "forbidden"})
+        else:
+            resolved.append((op, "event", op["event"]))
+    return resolved, rejected
+
+
+def _latest(kind, pairs):
+    """Time of last applied change of every (target, user) pair"""
+    if not pairs:
+        return {}
+    return {
+        (target, user): happened_at
+        for target, user, happened_at in (
+            AttendanceChange.objects
+            .filter(**{f"{kind}__in": {t for t, _ in pairs}, "user__in": {u for _, u in pairs}}, is_applied=True)
+            .order_by()
+            .values_list(kind, "user")
+            .annotate(latest=Max("happened_at"))
+        )
+    }
+
+
+def apply_operations(trainer, operations):
+    """Apply batch of client operations of `trainer` with last-writer-wins by
+    operation time. Repeated operations (same client id) are not applied twice"""
+    operations = list({op["id"]: op for op in operations}.values())
+    known = dict(
+        AttendanceChange.objects
+        .filter(client_id__in=[op["id"] for op in operations])
+        .values_list("client_id", "is_applied")
+    )
+    result = {
+        "applied": [str(id) for id, is_applied in known.items() if is_applied],
+        "stale": [str(id) for id, is_applied in known.items() if not is_applied],
+    }
+    resolved, result["rejected"] = _resolve(trainer, [op for op in operations if op["id"] not in known])
+
+    with transaction.atomic():
+        changes = []
+        for kind, model in MEMBER_MODELS.items():
+            batch = sorted(
+                ((op, target) for op, op_kind, target in resolved if op_kind == kind),
+                key=lambda item: item[0]["timestamp"]
+            )
+            latest = _latest(kind, {(target, op["user"]) for op, target in batch})
+
+            final = {}
+            for op, target in batch:
+                pair = (target, op["user"])
+                is_applied = pair not in latest or op["timestamp"] >= latest[pair]
+                if is_applied:
+                    final[pair] = op["action"]
+                    result["applied"].append(str(op["id"]))
+                else:
+                    result["stale"].append(str(op["id"]))
+                changes.append(AttendanceChange(
+                    client_id=op["id"], user_id=op["user"], action=op["action"],
+                    is_applied=is_applied, happened_at=op["timestamp"], **{f"{kind}_id": target}
+                ))
+
+            model.objects.bulk_create(
+                [model(**{f"{kind}_id": target, "user_id": user})
+                 for (target, user), action in final.items() if action == "add"],
+                ignore_conflicts=True
+            )
+            removed = [Q(**{kind: target, "user": user}) for (target, user), action in final.items() if action == "remove"]
+            if removed:
+                model.objects.filter(reduce(or_, removed)).delete()
+
+        AttendanceChange.objects.bulk_create(changes, ignore_conflicts=True)
+        if any(change.training_id and change.is_applied for change in changes):
+            # bulk_create skips post_save, so cache is invalidated here
+            transaction.on_commit(lambda: invalidate("sections_detail"))
+    return result
+
+
+def changes_since(trainer, cursor, limit=CHANGES_LIMIT):
+    """Applied changes of trainings and events of trainer sections after cursor"""
+    sections = trainer.sections.values("id")
+    return list(
+        AttendanceChange.objects
+        .filter(id__gt=cursor, is_applied=True)
+        .filter(Q(training__section__in=sections) | Q(event__section__in=sections))
+        .select_related("training")
+        .only("id", "action", "user", "event", "happened_at", "training__uuid")
+        .order_by("id")[:limit]
+    )
+
+
+def sync(trainer, operations, cursor):
+    result = apply_operations(trainer, operations) if operations else {"applied": [], "stale": [], "rejected": []}
+    changes = changes_since(trainer, cursor)
+    result["changes"] = [{
+        "cursor": change.id,
+        "training": change.training.uuid if change.training_id else None,
+        "event": change.event_id,
+        "user": change.user_id,
+        "action": change.action,
+        "timestamp": change.happened_at,
+    } for change in changes]
+    result["cursor"] = changes[-1].id if changes else cursor
+    result["has_more"] = len(changes) == CHANGES_LIMIT
+    result["server_time"] = timezone.now()
+    return result
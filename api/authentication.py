@@ -0,0 +1,243 @@
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import CONSTANTS, knox_settings
+from redis.exceptions import RedisError
+from rest_framework import exceptions, status
+
+from sporthack.redis_client import get_redis
+
+REFRESH_KEY = "auth:refresh"
+
+
+class LocalTokenCache:
+    """Small in-process LRU of verified tokens with TTL. Entries of
+    other processes are not evicted on logout, so TTL must be short"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            value, cached_at = entry
+            if time.monotonic() - cached_at > self.ttl:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return value
+
+    def set(self, digest, value):
+        with self._lock:
+            self._entries[digest] = (value, time.monotonic())
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+
+local_tokens = LocalTokenCache(settings.AUTH_TOKEN_CACHE["LOCAL_SIZE"], settings.AUTH_TOKEN_CACHE["LOCAL_TTL"])
+
+
+def _redis_key(digest):
+    return f"auth:token:{digest}"
+
+
+def cache_token(auth_token):
+    value = {
+        "token_key": auth_token.token_key,
+        "user": auth_token.user_id,
+        "expiry": auth_token.expiry.isoformat() if auth_token.expiry else None,
+    }
+    local_tokens.set(auth_token.digest, value)
+
+    ttl = settings.AUTH_TOKEN_CACHE["REDIS_TTL"]
+    if auth_token.expiry:
+        ttl = min(ttl, int((auth_token.expiry - timezone.now()).total_seconds()))
+    if ttl <= 0:
+        return
+    try:
+        get_redis().set(_redis_key(auth_token.digest), json.dumps(value), ex=ttl)
+    except RedisError:
+        pass
+
+
+def get_cached_token(digest):
+    value = local_tokens.get(digest)
+    if value is None:
+        try:
+            data = get_redis().get(_redis_key(digest))
+        except RedisError:
+            data = None
+        if data is None:
+            return None
+        value = json.loads(data)
+        local_tokens.set(digest, value)
+    return value
+
+
+def evict_token(digest):
+    local_tokens.delete(digest)
+    try:
+        get_redis().delete(_redis_key(digest))
+    except RedisError:
+        pass
+
+
+def flush_refreshes(batch_size=1000):
+    """Write queued expiry refreshes to database with one update per batch.
+    Deleted (revoked) tokens are not in database, so they are not renewed"""
+    redis = get_redis()
+    refreshed = 0
+    while True:
+        digests = redis.zrange(REFRESH_KEY, 0, batch_size - 1)
+        if not digests:
+            return refreshed
+        refreshed += AuthToken.objects.filter(digest__in=digests).update(
+            expiry=timezone.now() + knox_settings.TOKEN_TTL
+        )
+        redis.zrem(REFRESH_KEY, *digests)
+
+
+def _purge(queryset, chunk_size):
+    """Delete rows of queryset by primary key in chunks, every chunk
+    in its own short transaction, so tables are not locked for long"""
+    deleted = 0
+    while True:
+        keys = list(queryset.order_by().values_list("pk", flat=True)[:chunk_size])
+        if not keys:
+            return deleted
+        count, _ = queryset.model.objects.filter(pk__in=keys).delete()
+        deleted += count
+
+
+def purge_expired(chunk_size=1000):
+    """Delete expired sessions (of admin) and expired tokens"""
+    now = timezone.now()
+    sessions = _purge(Session.objects.filter(expire_date__lt=now), chunk_size)
+    tokens = _purge(AuthToken.objects.filter(expiry__lt=now), chunk_size)
+    return sessions, tokens
+
+
+class LoginUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Слишком много попыток входа, повторите позже")
+    default_code = "login_unavailable"
+
+
+# Password hashing runs in bounded pool: PBKDF2 releases GIL, so hashes of
+# concurrent logins are computed in parallel, and when all slots are busy
+# login is rejected at once instead of queueing behind slow hashes
+_hashing_pool = ThreadPoolExecutor(
+    max_workers=settings.LOGIN_HASHING["WORKERS"],
+    thread_name_prefix="password-hashing"
+)
+_hashing_slots = threading.BoundedSemaphore(settings.LOGIN_HASHING["WORKERS"] + settings.LOGIN_HASHING["QUEUE"])
+
+
+def run_hashing(func, *args):
+    if not _hashing_slots.acquire(blocking=False):
+        raise LoginUnavailable()
+    future = _hashing_pool.submit(func, *args)
+    future.add_done_callback(lambda _: _hashing_slots.release())
+    try:
+        return future.result(timeout=settings.LOGIN_HASHING["TIMEOUT"])
+    except TimeoutError:
+        raise LoginUnavailable()
+
+
+def _verify(password, encoded):
+    """Check password against hash. Return whether it is correct and
+    whether hash must be updated to current hasher or iterations"""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    preferred = get_hasher()
+    is_correct = hasher.verify(password, encoded)
+    return is_correct, hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def authenticate_password(email, password):
+    """Same as `authenticate()` with model backend, but hashing runs in
+    hashing pool. Outdated hashes are replaced on successful login"""
+    User = get_user_model()
+    user = User._default_manager.filter(**{User.USERNAME_FIELD: email}).first()
+    if user is None or not user.has_usable_password():
+        # Hash anyway, so missing accounts can not be found by response time
+        run_hashing(make_password, password)
+        return None
+
+    is_correct, must_update = run_hashing(_verify, password, user.password)
+    if not is_correct or not user.is_active:
+        return None
+    if must_update:
+        user.password = run_hashing(make_password, password)
+        user.save(update_fields=["password"])
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Knox token authentication, which keeps verified tokens in local
+    and redis caches, so request with known token does not look up and
+    hash compare tokens in database. Auto refresh of expiry is queued
+    and written by `flush_token_refreshes` task at most once per
+    MIN_REFRESH_INTERVAL for every token, so requests do not write"""
+
+    def authenticate_credentials(self, token):
+        try:
+            digest = hash_token(token.decode("utf-8"))
+        except (TypeError, UnicodeDecodeError, binascii.Error):
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+
+        cached = get_cached_token(digest)
+        if cached is not None:
+            expiry = cached["expiry"] and datetime.fromisoformat(cached["expiry"])
+            if cached["token_key"] == token[:CONSTANTS.TOKEN_KEY_LENGTH].decode() and (not expiry or expiry > timezone.now()):
+                user = get_user_model().objects.filter(pk=cached["user"]).first()
+                if user is not None:
+                    auth_token = AuthToken(
+                        digest=digest, token_key=cached["token_key"], user=user, expiry=expiry
+                    )
+                    if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                        self.renew_token(auth_token)
+                    return self.validate_user(auth_token)
+            evict_token(digest)
+
+        user, auth_token = super().authenticate_credentials(token)
+        cache_token(auth_token)
+        return user, auth_token
+
+    def renew_token(self, auth_token):
+        new_expiry = timezone.now() + knox_settings.TOKEN_TTL
+        delta = (new_expiry - auth_token.expiry).total_seconds()
+        if delta <= knox_settings.MIN_REFRESH_INTERVAL:
+            return
+        auth_token.expiry = new_expiry
+        try:
+            get_redis().zadd(REFRESH_KEY, {auth_token.digest: time.time()})
+        except RedisError:
+            auth_token.save(update_fields=("expiry",))
+        cache_token(auth_token)
@@ -0,0 +1,113 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from redis.exceptions import RedisError
+from rest_framework.response import Response
+
+from sporthack.redis_client import get_redis
+
+STATS_KEY = "cache:response:stats"
+
+# Cached responses are grouped by data they depend on. Signals
+# invalidate groups, so only responses built from changed data are dropped
+GROUPS = ("sections", "sections_detail", "trainers", "rating")
+
+# While one request builds response, others wait for it instead
+# of building the same response at the same time
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+LOCK_POLL = 0.05
+
+
+def _generation_key(group):
+    return f"response:generation:{group}"
+
+
+def invalidate(*groups):
+    """Start new generation of groups, their cached responses are not read anymore
+    and expire by timeout. Generation is a timestamp, so it never repeats
+    even if generation key itself is evicted"""
+    try:
+        cache.set_many({_generation_key(group): time.time_ns() for group in groups}, timeout=None)
+    except RedisError:
+        pass
+
+
+def _record(endpoint, event):
+    try:
+        get_redis().hincrby(STATS_KEY, f"{endpoint}:{event}", 1)
+    except RedisError:
+        pass
+
+
+def stats():
+    """Hits, misses and waits of cached endpoints"""
+    return get_redis().hgetall(STATS_KEY)
+
+
+def _response_key(endpoint, groups, request, variant="", etag=None):
+    keys = [_generation_key(group) for group in groups]
+    generations = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        generations.update(missing)
+    params = f"{request.get_full_path()}:{settings.IMAGE_REPRESENTATION}:{variant}"
+    version = ":".join([str(generations[key]) for key in keys] + [str(etag)])
+    return f"response:{endpoint}:{hashlib.md5(f'{version}:{params}'.encode()).hexdigest()}"
+
+
+def _wait(key):
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return None
+
+
+def cached_response(endpoint, *groups, etag_func=None, timeout=None):
+    """Cache data of successful responses of view method by request path
+    and generations of `groups`. Cache errors fall back to the view.
+    Views with ETag pass its `etag_func`, data is cached by the ETag too,
+    so cached body always matches ETag built from current database state"""
+    timeout = timeout or settings.RESPONSE_CACHE_TIMEOUT
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            locked = False
+            try:
+                # Async views cache data with deferred images, so it is kept apart
+                variant = "deferred" if getattr(view, "defer_images", False) else ""
+                etag = etag_func(request, *args, **kwargs) if etag_func else None
+                key = _response_key(endpoint, groups, request, variant, etag)
+                data = cache.get(key)
+                event = "hit"
+                if data is None:
+                    locked = cache.add(f"{key}:lock", 1, timeout=LOCK_TIMEOUT)
+                    data = None if locked else _wait(key)
+                    event = "wait"
+            except RedisError:
+                return method(view, request, *args, **kwargs)
+
+            if data is not None:
+                _record(endpoint, event)
+                return Response(data, status=200)
+
+            _record(endpoint, "miss")
+            response = method(view, request, *args, **kwargs)
+            try:
+                if response.status_code == 200:
+                    cache.set(key, response.data, timeout=timeout)
+                if locked:
+                    cache.delete(f"{key}:lock")
+            except RedisError:
+                pass
+            return response
+        return wrapper
+    return decorator
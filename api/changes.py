@@ -0,0 +1,113 @@
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Section, SectionMember, SectionTraining, TrainingMember, SectionEvent, EventMember, Tombstone
+from .serializers import (
+    SectionChangeSerializer, SectionMemberSerializer,
+    TrainingChangeSerializer, TrainingMemberSerializer,
+    EventChangeSerializer, EventMemberSerializer,
+)
+
+CHANGES_LIMIT = 1000
+
+# Rows are stamped before their transaction commits, so cursor is moved
+# back a bit to not miss rows of transactions running during request
+CHANGES_LAG = timedelta(seconds=5)
+
+FEEDS = {
+    "sections": (lambda: Section.objects.prefetch_related("trainers"), SectionChangeSerializer),
+    "section_members": (lambda: SectionMember.objects.all(), SectionMemberSerializer),
+    "trainings": (lambda: SectionTraining.objects.all(), TrainingChangeSerializer),
+    "training_members": (lambda: TrainingMember.objects.all(), TrainingMemberSerializer),
+    "events": (lambda: SectionEvent.objects.all(), EventChangeSerializer),
+    "event_members": (lambda: EventMember.objects.all(), EventMemberSerializer),
+}
+
+MODEL_FEEDS = {
+    Section: "sections",
+    SectionMember: "section_members",
+    SectionTraining: "trainings",
+    TrainingMember: "training_members",
+    SectionEvent: "events",
+    EventMember: "event_members",
+}
+
+
+def encode_cursor(positions):
+    """Opaque cursor from (change time, id) of last row seen in every feed"""
+    data = {name: [changed_at.isoformat(), pk] for name, (changed_at, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Positions of feeds from cursor, ValueError if cursor is malformed"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        positions = {name: (parse_datetime(changed_at), int(pk)) for name, (changed_at, pk) in data.items()}
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError("Malformed cursor")
+    if set(positions) != set(FEEDS) | {"deleted"} or not all(
+            changed_at and changed_at.tzinfo for changed_at, _ in positions.values()):
+        raise ValueError("Malformed cursor")
+    return positions
+
+
+def since_positions(since):
+    """Positions of cursor, which reads every feed from `since` time"""
+    return dict.fromkeys(list(FEEDS) + ["deleted"], (since, 0))
+
+
+def _page(queryset, field, position, limit):
+    """Rows after (change time, id) position ordered by change time and id.
+    Return rows and position of last row, if there are more rows after it.
+    Id breaks ties, so rows stamped at once by bulk updates are paged too"""
+    if position is not None:
+        changed_at, pk = position
+        queryset = queryset.filter(Q(**{f"{field}__gt": changed_at}) | Q(**{field: changed_at, "id__gt": pk}))
+    rows = list(queryset.order_by(field, "id")[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (getattr(rows[-1], field), rows[-1].id)
+    return rows, None
+
+
+def changes(positions=None, context=None, limit=CHANGES_LIMIT):
+    """Rows of every feed changed since positions of cursor and ids of
+    deleted rows. Without cursor or with cursor older than kept tombstones
+    all rows are returned and client must drop its local copy"""
+    started = timezone.now()
+    caught_up = (started - CHANGES_LAG, 0)
+    reset = positions is None or positions["deleted"][0] < started - settings.TOMBSTONE_TTL
+    if reset:
+        positions = dict.fromkeys(FEEDS)
+        positions["deleted"] = caught_up
+
+    data = {"reset": reset}
+    cursor = {}
+    for name, (queryset, serializer) in FEEDS.items():
+        rows, last = _page(queryset(), "updated_at", positions[name], limit)
+        data[name] = serializer(rows, many=True, context=context or {}).data
+        cursor[name] = last
+
+    data["deleted"] = {name: [] for name in FEEDS}
+    cursor["deleted"] = None
+    if not reset:
+        queryset = Tombstone.objects.only("id", "model", "object_id", "deleted_at")
+        tombstones, cursor["deleted"] = _page(queryset, "deleted_at", positions["deleted"], limit)
+        for tombstone in tombstones:
+            data["deleted"][tombstone.model].append(tombstone.object_id)
+
+    data["has_more"] = any(last is not None for last in cursor.values())
+    # Feeds, which are read to the end, continue from a bit before request
+    # time, fully read tombstones of snapshot continue from its start
+    for name, last in cursor.items():
+        if last is None:
+            cursor[name] = positions["deleted"] if reset and name == "deleted" else caught_up
+    data["cursor"] = encode_cursor(cursor)
+    return data
@@ -0,0 +1,78 @@
+from zoneinfo import ZoneInfo
+
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from .models import SectionEvent
+from .schedule import SPANS, span_dates
+
+CALENDAR_MAX_DAYS = 62
+
+
+class SerializerFilterBackend(BaseFilterBackend):
+    """Filter queryset by fields of view's `filter_serializer_class`.
+    Params are read from query string of GET and from body of other
+    methods, unknown and empty params are ignored. Params from body
+    are set as view's `link_params`, so page links keep filtering"""
+
+    def filter_queryset(self, request, queryset, view):
+        data = request.query_params if request.method == "GET" else request.data
+        data = {key: value for key, value in data.items() if value not in ("", None)}
+        serializer = view.filter_serializer_class(data=data)
+        serializer.is_valid(raise_exception=True)
+        if request.method != "GET":
+            view.link_params = {field: data[field] for field in serializer.validated_data if field in data}
+        lookups = serializer.Meta.lookups
+        return queryset.filter(**{
+            lookups[field]: value
+            for field, value in serializer.validated_data.items()
+            if value is not None
+        })
+
+
+class SectionEventFilterSerializer(serializers.Serializer):
+    level = serializers.ChoiceField(choices=SectionEvent.LEVEL_CHOICES, required=False)
+    section = serializers.IntegerField(required=False)
+    is_active = serializers.BooleanField(required=False, allow_null=True)
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+
+    class Meta:
+        # Every lookup is covered by composite index of SectionEvent
+        lookups = {
+            "level": "level",
+            "section": "section",
+            "is_active": "is_active",
+            "date_from": "datetime__gte",
+            "date_to": "datetime__lt",
+        }
+
+
+class TrainingDateSerializer(serializers.Serializer):
+    date = serializers.DateField()
+
+
+class TrainingCalendarSerializer(serializers.Serializer):
+    """Params of trainings calendar. Without `date_to`
+    range is day, week or month containing `date_from`"""
+    date_from = serializers.DateField()
+    date_to = serializers.DateField(required=False)
+    span = serializers.ChoiceField(choices=SPANS, default="day")
+    section = serializers.IntegerField(required=False)
+    tz = serializers.CharField(required=False)
+
+    def validate_tz(self, value):
+        try:
+            ZoneInfo(value)
+        except (ValueError, KeyError, OSError):
+            raise serializers.ValidationError(f"Неизвестный часовой пояс: {value}")
+        return value
+
+    def validate(self, data):
+        if "date_to" not in data:
+            data["date_from"], data["date_to"] = span_dates(data["date_from"], data["span"])
+        if data["date_to"] < data["date_from"]:
+            raise serializers.ValidationError("date_to должна быть не раньше date_from")
+        if (data["date_to"] - data["date_from"]).days >= CALENDAR_MAX_DAYS:
+            raise serializers.ValidationError(f"Период не может быть больше {CALENDAR_MAX_DAYS} дней")
+        return data
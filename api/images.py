@@ -0,0 +1,103 @@
+import hashlib
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+RENDITIONS = {
+    "small": {"size": (96, 96), "format": "JPEG"},
+    "medium": {"size": (480, 480), "format": "JPEG"},
+    "webp": {"size": (480, 480), "format": "WEBP"},
+}
+RENDITION_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+# Image fields, which renditions are generated for
+IMAGE_FIELDS = {
+    "api.User": "photo",
+    "api.Section": "image",
+    "api.StudentAward": "file",
+}
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def content_hash(file):
+    """Return short content hash of stored file.
+    Hash is computed once per file version and cached in process"""
+    try:
+        stat = os.stat(file.path)
+    except (OSError, NotImplementedError, ValueError):
+        return None
+    return _file_digest(file.path, stat.st_mtime_ns, stat.st_size)
+
+
+def versioned_url(file, request=None):
+    """Return media url of file with content hash in query,
+    so url can be cached by clients forever"""
+    url = file.url
+    version = content_hash(file)
+    if version:
+        url = f"{url}?v={version}"
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def rendition_name(name, rendition):
+    base, _ = os.path.splitext(name)
+    extension = RENDITION_EXTENSIONS[RENDITIONS[rendition]["format"]]
+    return f"renditions/{base}.{rendition}.{extension}"
+
+
+def rendition_file(file, rendition):
+    """Return stored rendition of file or None if it is not generated yet"""
+    if not file or rendition not in RENDITIONS:
+        return None
+    name = rendition_name(file.name, rendition)
+    if not file.storage.exists(name):
+        return None
+    return file.__class__(file.instance, file.field, name)
+
+
+def create_renditions(file, force=False):
+    """Generate all missing renditions of image file.
+    Return names of created renditions"""
+    if not file:
+        return []
+
+    names = {rendition: rendition_name(file.name, rendition) for rendition in RENDITIONS}
+    if not force:
+        names = {r: name for r, name in names.items() if not file.storage.exists(name)}
+    if not names:
+        return []
+
+    try:
+        with file.storage.open(file.name, "rb") as f:
+            original = Image.open(f)
+            original = ImageOps.exif_transpose(original)
+            original.load()
+    except (OSError, UnidentifiedImageError):
+        return []
+
+    created = []
+    for rendition, name in names.items():
+        spec = RENDITIONS[rendition]
+        image = original.copy()
+        image.thumbnail(spec["size"], Image.LANCZOS)
+        if spec["format"] == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, format=spec["format"], quality=85, optimize=True)
+        if file.storage.exists(name):
+            file.storage.delete(name)
+        created.append(file.storage.save(name, ContentFile(buffer.getvalue())))
+    return created
@@ -0,0 +1,175 @@
+import logging
+
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+
+from sporthack.redis_client import get_redis
+from .models import Student, Section, SectionMember
+from .cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+REBUILD_CHUNK_SIZE = 5000
+
+# Missing board is rebuilt at most once per REBUILD_INTERVAL seconds
+REBUILD_INTERVAL = 60
+
+# Board is complete only if it was built by rebuild(), so scores are
+# added only to existing board. Board missing after deploy, restart
+# or eviction would otherwise be created with credited users only
+UPDATE_EXISTING = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("zadd", KEYS[1], unpack(ARGV))
+return 1
+"""
+
+
+class Leaderboard:
+    """Rating board kept in redis sorted set.
+    Global board is built from `User.rating`, section board from
+    `SectionMember.rating`. Database is used if redis is unavailable"""
+
+    def __init__(self, section=None):
+        self.section = section
+        if section is None:
+            self.key = "leaderboard:global"
+        else:
+            self.key = f"leaderboard:section:{section}"
+
+    def get_queryset(self):
+        if self.section is None:
+            return Student.objects.filter(is_active=True).values_list("id", "rating")
+        return SectionMember.objects.filter(section=self.section).values_list("user", "rating")
+
+    @property
+    def user_field(self):
+        return "id" if self.section is None else "user"
+
+    def top(self, limit=10):
+        """Return list of (user_id, score) with best scores"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.exists(self.key)
+            pipe.zrevrange(self.key, 0, limit - 1, withscores=True)
+            exists, entries = pipe.execute()
+            if exists:
+                return [(int(user), int(score)) for user, score in entries]
+            self.schedule_rebuild()
+        except RedisError:
+            logger.warning(f"Leaderboard {self.key} is unavailable", exc_info=True)
+        queryset = self.get_queryset().order_by("-rating", self.user_field)
+        return [(user, score or 0) for user, score in queryset[:limit]]
+
+    def rank(self, user_id):
+        """Return (rank, score) of user or None if user is not on the board"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.exists(self.key)
+            pipe.zrevrank(self.key, user_id)
+            pipe.zscore(self.key, user_id)
+            exists, rank, score = pipe.execute()
+            if rank is not None:
+                return rank + 1, int(score)
+            if not exists:
+                self.schedule_rebuild()
+        except RedisError:
+            logger.warning(f"Leaderboard {self.key} is unavailable", exc_info=True)
+        queryset = self.get_queryset()
+        entry = queryset.filter(**{self.user_field: user_id}).first()
+        if entry is None:
+            return None
+        score = entry[1] or 0
+        return queryset.filter(rating__gt=score).count() + 1, score
+
+    def around(self, user_id, count=2):
+        """Return list of (rank, user_id, score) of user and `count` neighbours on each side"""
+        position = self.rank(user_id)
+        if position is None:
+            return []
+        start = max(position[0] - 1 - count, 0)
+        stop = position[0] - 1 + count
+        try:
+            entries = get_redis().zrevrange(self.key, start, stop, withscores=True)
+            if entries:
+                return [(start + i + 1, int(user), int(score)) for i, (user, score) in enumerate(entries)]
+        except RedisError:
+            logger.warning(f"Leaderboard {self.key} is unavailable", exc_info=True)
+        queryset = self.get_queryset().order_by("-rating", self.user_field)
+        return [(start + i + 1, user, score or 0) for i, (user, score) in enumerate(queryset[start:stop + 1])]
+
+    def update(self, scores):
+        """Set scores of users from mapping {user_id: score}"""
+        if not scores:
+            return
+        args = []
+        for user, score in scores.items():
+            args += [score or 0, user]
+        try:
+            if not get_redis().eval(UPDATE_EXISTING, 1, self.key, *args):
+                self.schedule_rebuild()
+        except RedisError:
+            logger.warning(f"Leaderboard {self.key} is not updated", exc_info=True)
+
+    def schedule_rebuild(self):
+        """Rebuild missing board in background, reads use database until then.
+        Boards of unknown sections are not built"""
+        from .tasks import rebuild_leaderboard
+
+        if self.section is not None and not Section.objects.filter(pk=self.section).exists():
+            return
+        if not get_redis().set(f"{self.key}:rebuild:scheduled", 1, ex=REBUILD_INTERVAL, nx=True):
+            return
+        try:
+            rebuild_leaderboard.delay(self.section)
+        except OperationalError:
+            logger.warning(f"Leaderboard {self.key} rebuild is not scheduled", exc_info=True)
+
+    def remove(self, user_id):
+        try:
+            get_redis().zrem(self.key, user_id)
+        except RedisError:
+            logger.warning(f"Leaderboard {self.key} is not updated", exc_info=True)
+
+    def rebuild(self):
+        """Replace board with scores from database"""
+        redis = get_redis()
+        tmp_key = f"{self.key}:rebuild"
+        redis.delete(tmp_key)
+        chunk = {}
+        for user, score in self.get_queryset().order_by().iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            chunk[user] = score or 0
+            if len(chunk) >= REBUILD_CHUNK_SIZE:
+                redis.zadd(tmp_key, chunk)
+                chunk = {}
+        if chunk:
+            redis.zadd(tmp_key, chunk)
+        if redis.exists(tmp_key):
+            redis.rename(tmp_key, self.key)
+        else:
+            redis.delete(self.key)
+
+
+def sync_ratings(user_ids, section_ids=()):
+    """Copy current ratings of users to global and section boards"""
+    Leaderboard().update(dict(Student.objects.filter(id__in=user_ids).values_list("id", "rating")))
+
+    sections = {}
+    members = (
+        SectionMember.objects
+        .filter(user__in=user_ids, section__in=section_ids)
+        .values_list("section", "user", "rating")
+    )
+    for section, user, rating in members:
+        sections.setdefault(section, {})[user] = rating
+    for section, scores in sections.items():
+        Leaderboard(section).update(scores)
+    invalidate("rating")
+
+
+def rebuild_leaderboards():
+    Leaderboard().rebuild()
+    for section in Section.objects.values_list("id", flat=True):
+        Leaderboard(section).rebuild()
+    invalidate("rating")
@@ -0,0 +1,53 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load endpoints of running deployments side by side, e.g. WSGI `web` "
+        "and ASGI `web-asgi` (docker compose --profile benchmark up)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="Full urls to load, every url is loaded in separate run")
+        parser.add_argument("--token", help="Knox token of user, read endpoints require authentication")
+        parser.add_argument("--requests", type=int, default=500, help="Number of requests in every run")
+        parser.add_argument("--concurrency", type=int, default=50, help="Number of concurrent clients")
+        parser.add_argument("--timeout", type=float, default=30)
+
+    def handle(self, *args, **options):
+        headers = {"Authorization": f"Token {options['token']}"} if options["token"] else {}
+        for url in options["urls"]:
+            self.run(url, headers, options["requests"], options["concurrency"], options["timeout"])
+
+    def run(self, url, headers, requests, concurrency, timeout):
+        def fetch(_):
+            started = time.perf_counter()
+            try:
+                with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+                    response.read()
+                    ok = response.status == 200
+            except (HTTPError, URLError, OSError):
+                ok = False
+            return ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(fetch, range(requests)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for ok, latency in results if ok)
+        errors = requests - len(latencies)
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f"{url}: all {requests} requests failed"))
+            return
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{url}: {len(latencies) / elapsed:.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, {errors} errors"
+        )
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import authenticate, get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.authentication import LoginUnavailable, authenticate_password
+
+EMAIL = "benchmark-login@localhost"
+
+
+class Command(BaseCommand):
+    help = "Measure logins per second of one worker: plain authenticate() and login with hashing pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100, help="Number of logins in every run")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent logins in pooled run")
+
+    def handle(self, *args, **options):
+        password = "benchmark-password"
+        User = get_user_model()
+        User.objects.filter(email=EMAIL).delete()
+        User.objects.create_user(email=EMAIL, password=password, first_name="Benchmark", last_name="Login")
+        try:
+            self.run("authenticate(), sequential", 1, options["requests"],
+                     lambda: authenticate(email=EMAIL, password=password))
+            self.run(f"hashing pool, {options['concurrency']} concurrent", options["concurrency"], options["requests"],
+                     lambda: authenticate_password(EMAIL, password))
+        finally:
+            User.objects.filter(email=EMAIL).delete()
+
+    def run(self, title, concurrency, requests, login):
+        rejected = 0
+
+        def attempt(_):
+            nonlocal rejected
+            try:
+                if login() is None:
+                    raise RuntimeError("Benchmark login failed")
+            except LoginUnavailable:
+                rejected += 1
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(attempt, range(requests)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{title}: {requests / elapsed:.1f} logins/s, "
+            f"{elapsed / requests * 1000:.1f} ms per login, {rejected} rejected"
+        )
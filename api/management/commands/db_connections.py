@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from sporthack.db import stats
+
+
+class Command(BaseCommand):
+    help = "Show database connections opened and health checks failed against requests and tasks served"
+
+    def handle(self, *args, **options):
+        counters = {key: int(value) for key, value in stats().items()}
+        for role in sorted({key.split(":", 1)[0] for key in counters}):
+            served = counters.get(f"{role}:requests", 0) + counters.get(f"{role}:tasks", 0)
+            opened = counters.get(f"{role}:opened", 0)
+            reuse = f", {opened / served:.2f} connections per request" if served else ""
+            self.stdout.write(
+                f"{role}: {opened} opened, {counters.get(f'{role}:unusable', 0)} unusable, {served} served{reuse}"
+            )
@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_FIELDS, create_renditions
+from api.tasks import generate_renditions
+
+
+class Command(BaseCommand):
+    help = "Generate missing thumbnails of uploaded images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Regenerate existing renditions"
+        )
+        parser.add_argument(
+            "--async", action="store_true", dest="use_celery",
+            help="Send images to celery workers instead of processing in place"
+        )
+
+    def handle(self, *args, **options):
+        for model, field in IMAGE_FIELDS.items():
+            Model = apps.get_model(model)
+            queryset = Model.objects.exclude(**{field: ""}).only("pk", field)
+            count = 0
+            for instance in queryset.iterator(chunk_size=500):
+                if options["use_celery"]:
+                    generate_renditions.delay(model, instance.pk, force=options["force"])
+                    count += 1
+                else:
+                    count += len(create_renditions(getattr(instance, field), force=options["force"]))
+            self.stdout.write(self.style.SUCCESS(f"{model}: {count}"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.leaderboard import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = "Rebuild global and section leaderboards in redis from database"
+
+    def handle(self, *args, **options):
+        rebuild_leaderboards()
+        self.stdout.write(self.style.SUCCESS("Leaderboards rebuilt"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.ratings import backfill_ledger, rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = "Rebuild ratings of students and section members from the rating ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill", action="store_true",
+            help="Create ledger entries for already settled trainings first"
+        )
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            count = backfill_ledger()
+            self.stdout.write(f"Ledger entries backfilled: {count}")
+        rebuild_aggregates()
+        self.stdout.write(self.style.SUCCESS("Ratings rebuilt"))
@@ -1,6 +1,9 @@
+from datetime import timedelta
+
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import BaseUserManager
-from django.db.models import Q
+from django.db import models
+from django.db.models import F, Q, ExpressionWrapper
 
 
 class UserManager(BaseUserManager):
@@ -49,3 +52,15 @@ class TrainerManager(BaseUserManager):
 class AdminManager(BaseUserManager):
     def get_queryset(self):
         return super().get_queryset().filter(Q(is_staff=True) | Q(is_superuser=True))
+
+
+class SectionTrainingQuerySet(models.QuerySet):
+    def with_end(self):
+        """Annotate `end_datetime`: start of training plus its duration"""
+        duration = ExpressionWrapper(F("duration") * timedelta(minutes=1), output_field=models.DurationField())
+        return self.annotate(
+            end_datetime=ExpressionWrapper(F("datetime") + duration, output_field=models.DateTimeField())
+        )
+
+    def ended(self, now):
+        return self.with_end().filter(end_datetime__lte=now)
@@ -1,13 +1,15 @@
 import uuid
+from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core import validators
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
-from .managers import UserManager, StudentManager, TrainerManager, AdminManager
+from .managers import UserManager, StudentManager, TrainerManager, AdminManager, SectionTrainingQuerySet
 from .email import AwardNoVerified
 
 
@@ -40,6 +42,7 @@ class User(AbstractUser):
     rank = models.TextField(verbose_name=_("Звание"), blank=True)
     phone = PhoneNumberField(verbose_name=_("Номер телефона"), blank=True)
     is_trainer = models.BooleanField(verbose_name=_("Тренер"), default=False)
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ()
@@ -49,6 +52,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = _("Пользователь")
         verbose_name_plural = _("Пользователи")
+        indexes = [
+            models.Index(fields=["-rating"], name="user_rating_idx"),
+            models.Index(fields=["updated_at"], name="user_updated_at_idx"),
+        ]
 
     def __str__(self):
         return f"{self.last_name} {self.first_name}"
@@ -90,6 +97,7 @@ class StudentAward(models.Model):
     )
     title = models.CharField(verbose_name=_("Название награды"), max_length=100)
     verified = models.BooleanField(verbose_name=_("Проверено"), default=False)
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
 
     class Meta:
         verbose_name = _("Награда")
@@ -98,8 +106,9 @@ class StudentAward(models.Model):
     def delete(self):
         context = {"award_title": self.title, "domain": settings.SITE_DOMAIN}
         to = [self.user.email]
-        AwardNoVerified(context=context).send(to)
-        return super().delete()
+        with transaction.atomic():
+            OutboxEmail.enqueue(AwardNoVerified, to, context, key=f"award-no-verified:{self.pk}")
+            return super().delete()
 
 
 class Trainer(User):
@@ -131,6 +140,12 @@ class Section(models.Model):
         verbose_name=_("Тренеры"),
         related_name="sections"
     )
+    members = models.ManyToManyField(
+        Student,
+        verbose_name=_("Участники"),
+        through="SectionMember",
+        related_name="member_sections"
+    )
     title = models.CharField(_("Название секции"), max_length=255)
     description = models.TextField(_("Описание секции"))
     image = models.ImageField(
@@ -140,9 +155,14 @@ class Section(models.Model):
         blank=True,
     )
 
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
+
     class Meta:
         verbose_name = _("Секция")
         verbose_name_plural = _("Секции")
+        indexes = [
+            models.Index(fields=["updated_at"]),
+        ]
 
     def __str__(self):
         return f"{self.title}"
@@ -171,10 +191,15 @@ class SectionMember(models.Model):
         blank=True
     )
 
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
+
     class Meta:
         verbose_name = _("Участник секции")
         verbose_name_plural = _("Участники секции")
         unique_together = ['section', 'user']
+        indexes = [
+            models.Index(fields=["updated_at"]),
+        ]
 
     def __str__(self):
         return f"{self.user.last_name} {self.user.first_name}"
@@ -218,10 +243,18 @@ class SectionEvent(models.Model):
     )
     datetime = models.DateTimeField(verbose_name=_("Дата проведения"))
     place = models.TextField(verbose_name=_("Место проведения"))
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
 
     class Meta:
         verbose_name = _("Мероприятие")
         verbose_name_plural = _("Мероприятия")
+        indexes = [
+            models.Index(fields=["section", "datetime"]),
+            models.Index(fields=["level", "datetime"]),
+            models.Index(fields=["is_active", "datetime"]),
+            models.Index(fields=["datetime"]),
+            models.Index(fields=["updated_at"]),
+        ]
 
 
 class EventMember(models.Model):
@@ -236,10 +269,15 @@ class EventMember(models.Model):
         on_delete=models.CASCADE
     )
 
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
+
     class Meta:
         verbose_name = _("Участник мероприятия")
         verbose_name_plural = _("Участники мероприятия")
         unique_together = ['event', 'user']
+        indexes = [
+            models.Index(fields=["updated_at"]),
+        ]
 
     def __str__(self):
         return f"{self.user.last_name} {self.user.first_name}"
@@ -248,7 +286,8 @@ class EventMember(models.Model):
 class SectionTraining(models.Model):
     uuid = models.UUIDField(
         verbose_name="Уникальный индентификатор",
-        default=uuid.uuid1)
+        default=uuid.uuid1,
+        unique=True)
     section = models.ForeignKey(
         Section,
         verbose_name=_("Секция"),
@@ -269,10 +308,22 @@ class SectionTraining(models.Model):
     datetime = models.DateTimeField(verbose_name=_("Дата проведения"))
     place = models.TextField(verbose_name=_("Место проведения"))
     is_active = models.BooleanField(verbose_name=_("Активна?"), default=True)
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
+
+    objects = SectionTrainingQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("Тренировка")
         verbose_name_plural = _("Тренировки")
+        indexes = [
+            models.Index(fields=["section", "datetime"]),
+            models.Index(fields=["datetime"]),
+            models.Index(fields=["updated_at"]),
+        ]
+
+    @property
+    def ends_at(self):
+        return self.datetime + timedelta(minutes=self.duration)
 
 
 class TrainingMember(models.Model):
@@ -287,10 +338,212 @@ class TrainingMember(models.Model):
         on_delete=models.CASCADE
     )
 
+    updated_at = models.DateTimeField(verbose_name=_("Дата изменения"), auto_now=True)
+
     class Meta:
         verbose_name = _("Участник тренировки")
         verbose_name_plural = _("Участники тренировки")
         unique_together = ['training', 'user']
+        indexes = [
+            models.Index(fields=["updated_at"]),
+        ]
 
     def __str__(self):
         return f"{self.user.last_name} {self.user.first_name}"
+
+
+class Tombstone(models.Model):
+    """Mark of deleted object, so clients syncing changes can drop it"""
+    MODEL_CHOICES = [
+        ("sections", "Секция"),
+        ("section_members", "Участник секции"),
+        ("trainings", "Тренировка"),
+        ("training_members", "Участник тренировки"),
+        ("events", "Мероприятие"),
+        ("event_members", "Участник мероприятия")
+    ]
+
+    model = models.CharField(verbose_name=_("Модель"), max_length=50, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField(verbose_name=_("Идентификатор объекта"))
+    deleted_at = models.DateTimeField(verbose_name=_("Дата удаления"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Удаленный объект")
+        verbose_name_plural = _("Удаленные объекты")
+        indexes = [
+            models.Index(fields=["deleted_at"]),
+            models.Index(fields=["model", "deleted_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.model}: {self.object_id}"
+
+
+class AttendanceChange(models.Model):
+    """Journal of changes of trainings and events members.
+    Id of record is used as sync cursor by clients"""
+    ACTION_CHOICES = [
+        ("add", "Добавление"),
+        ("remove", "Удаление")
+    ]
+
+    client_id = models.UUIDField(
+        verbose_name=_("Идентификатор операции клиента"),
+        null=True,
+        blank=True,
+        unique=True
+    )
+    training = models.ForeignKey(
+        SectionTraining,
+        verbose_name=_("Тренировка"),
+        related_name="attendance_changes",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE
+    )
+    event = models.ForeignKey(
+        SectionEvent,
+        verbose_name=_("Мероприятие"),
+        related_name="attendance_changes",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        Student,
+        verbose_name=_("Участник"),
+        related_name="attendance_changes",
+        on_delete=models.CASCADE
+    )
+    action = models.CharField(verbose_name=_("Действие"), max_length=10, choices=ACTION_CHOICES)
+    is_applied = models.BooleanField(
+        verbose_name=_("Применено?"),
+        default=True,
+        help_text="Устаревшие операции клиента записываются, но не применяются"
+    )
+    happened_at = models.DateTimeField(verbose_name=_("Время операции"), default=timezone.now)
+    created_at = models.DateTimeField(verbose_name=_("Дата записи"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Изменение участников")
+        verbose_name_plural = _("Изменения участников")
+        indexes = [
+            models.Index(fields=["training", "user"]),
+            models.Index(fields=["event", "user"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.action}: {self.user_id}"
+
+
+class RatingEntry(models.Model):
+    SOURCE_CHOICES = [
+        ("training", "Тренировка"),
+        ("event", "Мероприятие")
+    ]
+
+    user = models.ForeignKey(
+        Student,
+        verbose_name=_("Студент"),
+        related_name="rating_entries",
+        on_delete=models.CASCADE
+    )
+    section = models.ForeignKey(
+        Section,
+        verbose_name=_("Секция"),
+        related_name="rating_entries",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+    source = models.CharField(
+        verbose_name=_("Источник"),
+        max_length=20,
+        choices=SOURCE_CHOICES
+    )
+    training = models.ForeignKey(
+        SectionTraining,
+        verbose_name=_("Тренировка"),
+        related_name="rating_entries",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+    event = models.ForeignKey(
+        SectionEvent,
+        verbose_name=_("Мероприятие"),
+        related_name="rating_entries",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+    points = models.IntegerField(verbose_name=_("Баллы"), default=0)
+    created_at = models.DateTimeField(verbose_name=_("Дата начисления"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Начисление рейтинга")
+        verbose_name_plural = _("Начисления рейтинга")
+        constraints = [
+            models.UniqueConstraint(fields=["user", "training"], name="unique_training_credit"),
+            models.UniqueConstraint(fields=["user", "event"], name="unique_event_credit"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "section"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.points}"
+
+
+class OutboxEmail(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Ожидает отправки"),
+        ("sent", "Отправлено"),
+        ("failed", "Не отправлено")
+    ]
+
+    key = models.CharField(
+        verbose_name=_("Ключ"),
+        max_length=255,
+        unique=True,
+        help_text="Письма с одинаковым ключом отправляются один раз"
+    )
+    email_class = models.CharField(verbose_name=_("Шаблон письма"), max_length=255)
+    to = models.JSONField(verbose_name=_("Получатели"))
+    context = models.JSONField(verbose_name=_("Контекст"), default=dict)
+    status = models.CharField(
+        verbose_name=_("Статус"),
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="pending"
+    )
+    attempts = models.PositiveIntegerField(verbose_name=_("Попытки отправки"), default=0)
+    next_attempt_at = models.DateTimeField(verbose_name=_("Следующая попытка"), default=timezone.now)
+    last_error = models.TextField(verbose_name=_("Последняя ошибка"), blank=True)
+    created_at = models.DateTimeField(verbose_name=_("Создано"), auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name=_("Отправлено"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Письмо")
+        verbose_name_plural = _("Исходящие письма")
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.key}"
+
+    @classmethod
+    def enqueue(cls, email_class, to, context, key):
+        """Save email to outbox in current transaction.
+        Email is sent by celery worker after commit"""
+        email, _ = cls.objects.get_or_create(
+            key=key,
+            defaults={
+                "email_class": f"{email_class.__module__}.{email_class.__name__}",
+                "to": to,
+                "context": context,
+            }
+        )
+        return email
@@ -0,0 +1,86 @@
+import logging
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+# Claimed emails are hidden from other workers while batch is being sent
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboxEmail.objects.filter(
+            id__in=[email.id for email in emails]
+        ).update(next_attempt_at=now + OUTBOX_CLAIM_TIMEOUT)
+    return emails
+
+
+def _fail(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = "failed"
+    else:
+        email.next_attempt_at = timezone.now() + OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+
+
+def send_batch(batch_size=OUTBOX_BATCH_SIZE):
+    """Send one batch of pending emails through single SMTP connection.
+    Return number of sent emails"""
+    emails = _claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Mail server is unavailable", exc_info=True)
+        for email in emails:
+            _fail(email, e)
+        failed = emails
+    else:
+        for email in emails:
+            try:
+                message = import_string(email.email_class)(context=email.context, connection=connection)
+                message.send(email.to)
+                sent.append(email.id)
+            except Exception as e:
+                logger.warning(f"Email {email.key} is not sent", exc_info=True)
+                _fail(email, e)
+                failed.append(email)
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.filter(id__in=sent).update(status="sent", sent_at=timezone.now())
+    OutboxEmail.objects.bulk_update(failed, ["attempts", "last_error", "status", "next_attempt_at"])
+    return len(sent)
+
+
+def send_pending(batch_size=OUTBOX_BATCH_SIZE):
+    """Send pending emails batch by batch until batch fails or outbox
+    is empty. Return number of sent emails"""
+    total = 0
+    while True:
+        sent = send_batch(batch_size)
+        total += sent
+        if sent < batch_size:
+            return total
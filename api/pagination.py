@@ -0,0 +1,39 @@
+from collections import OrderedDict
+
+from rest_framework import pagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorPagination(pagination.CursorPagination):
+    """Keyset pagination by `id`. Total count of objects
+    is returned only if requested with `count=true` param"""
+    ordering = ("id",)
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ("1", "true"):
+            self.count = queryset.count()
+        page = super().paginate_queryset(queryset, request, view)
+        # Params read from body of POST are put to links, which are GET requests
+        for key, value in getattr(view, "link_params", {}).items():
+            self.base_url = replace_query_param(self.base_url, key, value)
+        return page
+
+    def get_paginated_response(self, data):
+        response = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]
+        if self.count is not None:
+            response.insert(0, ("count", self.count))
+        return Response(OrderedDict(response))
+
+
+class DatetimeCursorPagination(CursorPagination):
+    """Keyset pagination of trainings and events by `datetime`, `id`"""
+    ordering = ("datetime", "id")
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import User, SectionMember, SectionTraining, TrainingMember, RatingEntry
+from .leaderboard import rebuild_leaderboards, sync_ratings
+from .cache import invalidate
+
+SETTLEMENT_BATCH_SIZE = 500
+LEDGER_BATCH_SIZE = 1000
+
+
+def _entries(**lookups):
+    """Subquery of ledger entries, grouped by user"""
+    return (
+        RatingEntry.objects
+        .filter(**lookups)
+        .order_by()
+        .values("user")
+    )
+
+
+def _training_credits(trainings):
+    """Ledger entries for every attendance of trainings"""
+    attendances = (
+        TrainingMember.objects
+        .filter(training__in=trainings)
+        .values_list("user", "training", "training__section", "training__duration")
+    )
+    return [
+        RatingEntry(
+            user_id=user,
+            training_id=training,
+            section_id=section,
+            source="training",
+            points=duration
+        )
+        for user, training, section, duration in attendances.iterator()
+    ]
+
+
+def _apply_entries(users, members, **lookups):
+    """Add sums of selected ledger entries to rating aggregates"""
+    user_entries = _entries(user=OuterRef("pk"), **lookups)
+    users.filter(
+        Exists(user_entries)
+    ).update(
+        rating=Coalesce(F("rating"), Value(0)) + Subquery(
+            user_entries.annotate(total=Sum("points")).values("total")
+        ),
+        updated_at=timezone.now()
+    )
+
+    member_entries = _entries(user=OuterRef("user"), section=OuterRef("section"), **lookups)
+    members.filter(
+        Exists(member_entries)
+    ).update(
+        rating=F("rating") + Subquery(
+            member_entries.annotate(total=Sum("points")).values("total")
+        ),
+        pass_trainings=F("pass_trainings") + Subquery(
+            member_entries.annotate(total=Count("id", filter=Q(source="training"))).values("total")
+        ),
+        updated_at=timezone.now()
+    )
+
+
+def settle_batch(now=None, batch_size=SETTLEMENT_BATCH_SIZE, ids=None):
+    """Credit ratings for one batch of ended trainings, optionally
+    limited to trainings with `ids`. Trainings are claimed with row locks
+    and deactivated in the same transaction, so concurrent or repeated
+    runs never credit twice. Return number of settled trainings"""
+    now = now or timezone.now()
+    queryset = SectionTraining.objects.ended(now).filter(is_active=True)
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    with transaction.atomic():
+        trainings = list(
+            queryset
+            .select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not trainings:
+            return 0
+
+        entries = _training_credits(trainings)
+        RatingEntry.objects.bulk_create(
+            entries,
+            batch_size=LEDGER_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        # Claimed trainings were active, so all their entries are created
+        # by this transaction and are added to aggregates exactly once
+        _apply_entries(User.objects.all(), SectionMember.objects.all(), training__in=trainings)
+
+        SectionTraining.objects.filter(id__in=trainings).update(is_active=False, updated_at=now)
+
+        user_ids = {entry.user_id for entry in entries}
+        section_ids = {entry.section_id for entry in entries}
+        transaction.on_commit(lambda: sync_ratings(user_ids, section_ids))
+        transaction.on_commit(lambda: invalidate("sections_detail"))
+    return len(trainings)
+
+
+def settle_trainings(now=None, batch_size=SETTLEMENT_BATCH_SIZE):
+    """Settle all finished trainings batch by batch.
+    Return number of settled trainings"""
+    now = now or timezone.now()
+    settled = 0
+    while True:
+        count = settle_batch(now, batch_size)
+        settled += count
+        if count < batch_size:
+            return settled
+
+
+def backfill_ledger():
+    """Create ledger entries for attendances of trainings
+    settled before the ledger existed. Return number of entries"""
+    trainings = SectionTraining.objects.filter(is_active=False).values_list("id", flat=True)
+    entries = _training_credits(trainings)
+    RatingEntry.objects.bulk_create(entries, batch_size=LEDGER_BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def rebuild_aggregates():
+    """Recalculate all rating aggregates from the ledger"""
+    with transaction.atomic():
+        now = timezone.now()
+        User.objects.filter(is_trainer=False).update(rating=0, updated_at=now)
+        SectionMember.objects.update(rating=0, pass_trainings=0, updated_at=now)
+        _apply_entries(User.objects.filter(is_trainer=False), SectionMember.objects.all())
+        transaction.on_commit(rebuild_leaderboards)
+        transaction.on_commit(lambda: invalidate("sections_detail"))
@@ -0,0 +1,157 @@
+import calendar
+import hashlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import Student, SectionMember, SectionTraining, SectionEvent
+
+SPANS = ("day", "week", "month")
+
+
+def span_dates(date, span):
+    """Return first and last date of day, week or month containing date"""
+    if span == "week":
+        start = date - timedelta(days=date.weekday())
+        return start, start + timedelta(days=6)
+    if span == "month":
+        last_day = calendar.monthrange(date.year, date.month)[1]
+        return date.replace(day=1), date.replace(day=last_day)
+    return date, date
+
+
+def local_range(first_date, last_date, tz=None):
+    """Return half-open range [start, end) of aware datetimes, which covers
+    dates from first to last inclusive in timezone `tz`.
+    Filtering by such range keeps index on datetime column usable"""
+    tz = ZoneInfo(tz) if isinstance(tz, str) else (tz or timezone.get_default_timezone())
+    start = datetime.combine(first_date, time.min, tzinfo=tz)
+    end = datetime.combine(last_date + timedelta(days=1), time.min, tzinfo=tz)
+    return start, end
+
+
+ICAL_WINDOW = timedelta(days=30)
+
+
+def calendar_token(user):
+    """Return token of user's calendar feed.
+    Token is invalidated when user changes password"""
+    digest = salted_hmac("api.schedule.calendar", f"{user.pk}{user.password}", algorithm="sha256").hexdigest()
+    return f"{user.pk}-{digest[:32]}"
+
+
+def get_calendar_user(token):
+    pk, _, digest = token.partition("-")
+    if not pk.isdigit():
+        return None
+    user = Student.objects.filter(pk=pk, is_active=True).only("id", "password").first()
+    if user is None or not constant_time_compare(calendar_token(user), token):
+        return None
+    return user
+
+
+def _escape(text):
+    return (
+        str(text)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    """Fold content line to 75 octets as required by RFC 5545"""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts, chunk = [], b""
+    for char in line:
+        encoded = char.encode()
+        if len(chunk) + len(encoded) > (75 if not parts else 74):
+            parts.append(chunk.decode())
+            chunk = b""
+        chunk += encoded
+    parts.append(chunk.decode())
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _utc(dt):
+    return dt.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+class StudentCalendar:
+    """iCalendar feed of trainings of student's sections and his events"""
+
+    def __init__(self, user, now=None):
+        since = (now or timezone.now()) - ICAL_WINDOW
+        self.sections = SectionMember.objects.filter(user=user)
+        self.trainings = SectionTraining.objects.filter(section__member__user=user, datetime__gte=since)
+        self.events = SectionEvent.objects.filter(members=user, datetime__gte=since)
+
+    def get_version(self):
+        """Return (etag, last_modified) of feed, computed by aggregates only.
+        Titles of sections are rendered too, so their changes are included"""
+        trainings = self.trainings.aggregate(count=Count("id"), updated=Max("updated_at"))
+        events = self.events.aggregate(
+            count=Count("id"), updated=Max("updated_at"), sections_updated=Max("section__updated_at")
+        )
+        sections = self.sections.aggregate(count=Count("id"), updated=Max("section__updated_at"))
+        updated = [
+            dt for dt in (trainings["updated"], events["updated"], events["sections_updated"], sections["updated"])
+            if dt is not None
+        ]
+        last_modified = max(updated) if updated else None
+        version = (
+            f"{sections['count']}:{trainings['count']}:{events['count']}:"
+            f"{last_modified and last_modified.timestamp()}"
+        )
+        return hashlib.md5(version.encode()).hexdigest(), last_modified
+
+    def __iter__(self):
+        domain = settings.SITE_DOMAIN or "sporthack"
+        yield from map(_fold, (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//SportHack//Schedule//RU",
+            "CALSCALE:GREGORIAN",
+            "X-WR-CALNAME:SportHack",
+        ))
+
+        trainings = self.trainings.order_by().values_list(
+            "id", "section__title", "datetime", "duration", "place", "updated_at"
+        )
+        for pk, section, start, duration, place, updated in trainings.iterator():
+            yield "".join(map(_fold, (
+                "BEGIN:VEVENT",
+                f"UID:training-{pk}@{domain}",
+                f"DTSTAMP:{_utc(updated)}",
+                f"DTSTART:{_utc(start)}",
+                f"DTEND:{_utc(start + timedelta(minutes=duration))}",
+                f"SUMMARY:{_escape(f'Тренировка: {section}')}",
+                f"LOCATION:{_escape(place)}",
+                f"CATEGORIES:{_escape(section)}",
+                "END:VEVENT",
+            )))
+
+        events = self.events.order_by().values_list(
+            "id", "title", "section__title", "datetime", "place", "updated_at"
+        )
+        for pk, title, section, start, place, updated in events.iterator():
+            yield "".join(map(_fold, (
+                "BEGIN:VEVENT",
+                f"UID:event-{pk}@{domain}",
+                f"DTSTAMP:{_utc(updated)}",
+                f"DTSTART:{_utc(start)}",
+                f"SUMMARY:{_escape(title)}",
+                f"LOCATION:{_escape(place)}",
+                f"CATEGORIES:{_escape(section)}",
+                "END:VEVENT",
+            )))
+
+        yield _fold("END:VCALENDAR")
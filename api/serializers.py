@@ -1,9 +1,10 @@
 import base64
 
-from django.contrib.auth import authenticate
+from django.conf import settings
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
 from django.utils import timezone
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField, Base64FieldMixin
+from drf_extra_fields.fields import Base64ImageField
 from djoser.serializers import UserCreatePasswordRetypeSerializer as DjoserUserCreateSerializer
 
 from .models import (
@@ -16,25 +17,86 @@ from .models import (
     SectionEvent,
     EventMember,
     SectionTraining,
-    TrainingMember
+    TrainingMember,
+    AttendanceChange
 )
+from .images import RENDITIONS, rendition_file, versioned_url
+from .authentication import authenticate_password
+from .throttling import account_ident, client_ident, login_failures_limit, login_ip_limit
+
+IMAGE_REPRESENTATIONS = ("url", "base64", "none")
+EVENT_MEMBERS_LIMIT = 20
+
+
+class DeferredImage:
+    """Placeholder of base64 image, which file is read later
+    by async view without blocking event loop"""
+
+    def __init__(self, path, extension):
+        self.path = path
+        self.extension = extension
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f"data:image/{self.extension};base64,{base64.b64encode(f.read()).decode()}"
 
 
 class CustomBase64ImageField(Base64ImageField):
+    """Image field, which representation is selected by
+    `images` query param of request: url, base64 or none.
+    Rendition of image is selected by `image_size` query param"""
+
+    def __init__(self, *args, **kwargs):
+        self.rendition = kwargs.pop("rendition", None)
+        super().__init__(*args, **kwargs)
+
+    def get_query_param(self, name):
+        request = self.context.get("request")
+        if request is None:
+            return None
+        return getattr(request, "query_params", request.GET).get(name)
+
+    def get_representation_mode(self):
+        mode = self.get_query_param("images")
+        if mode not in IMAGE_REPRESENTATIONS:
+            mode = settings.IMAGE_REPRESENTATION
+        if mode == "base64" and not self.represent_in_base64:
+            mode = "url"
+        return mode
+
+    def get_rendition(self):
+        rendition = self.get_query_param("image_size")
+        if rendition in RENDITIONS:
+            return rendition
+        return self.rendition
+
     def to_representation(self, file):
-        if self.represent_in_base64:
+        mode = self.get_representation_mode()
+        if mode == "none":
+            return None
+
+        rendition = self.get_rendition()
+        if rendition:
+            file = rendition_file(file, rendition) or file
+
+        if mode == "url":
             if not file:
-                return ""
+                return None
+            return versioned_url(file, self.context.get("request"))
+
+        if not file:
+            return ""
+
+        if self.context.get("defer_images"):
+            return DeferredImage(file.path, file.name.split(".")[-1])
 
-            try:
-                with open(file.path, "rb") as f:
-                    extenstion = file.file.name.split(".")[-1]
-                    base64_str = base64.b64encode(f.read()).decode()
-                    return f"data:image/{extenstion};base64,{base64_str}"
-            except Exception:
-                raise IOError("Error encoding file")
-        else:
-            return super(Base64FieldMixin, self).to_representation(file)
+        try:
+            with open(file.path, "rb") as f:
+                extenstion = file.file.name.split(".")[-1]
+                base64_str = base64.b64encode(f.read()).decode()
+                return f"data:image/{extenstion};base64,{base64_str}"
+        except Exception:
+            raise IOError("Error encoding file")
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -82,12 +144,16 @@ class StudentAwardSerializer(serializers.ModelSerializer):
 
 class SectionSerializer(serializers.ModelSerializer):
     image = CustomBase64ImageField(represent_in_base64=True, required=False)
-    count_members = serializers.IntegerField(source="members.count", read_only=True)
+    count_members = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Section
         fields = ("id", "title", "image", "count_members")
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.only("id", "title", "image").annotate(count_members=Count("member"))
+
 
 class TrainerSerializer(serializers.ModelSerializer):
     photo = CustomBase64ImageField(represent_in_base64=True, required=False)
@@ -130,6 +196,11 @@ class SectionTrainingSerializer(serializers.ModelSerializer):
             "section": {"write_only": True}
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        students = Student.objects.only(*StudentSerializer.Meta.fields)
+        return queryset.prefetch_related(Prefetch("members", queryset=students))
+
 
 class SectionMemberSerializer(serializers.ModelSerializer):
 
@@ -146,14 +217,37 @@ class EventMemberSerializer(serializers.ModelSerializer):
 
 
 class SectionEventSerializer(serializers.ModelSerializer):
+    """Event with first EVENT_MEMBERS_LIMIT members,
+    all members are listed by `event/<pk>/members`"""
     members = serializers.SerializerMethodField()
+    members_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = SectionEvent
         fields = "__all__"
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        first_members = (
+            EventMember.objects
+            .filter(event=OuterRef("event"))
+            .order_by("id")
+            .values("id")[:EVENT_MEMBERS_LIMIT]
+        )
+        members = (
+            EventMember.objects
+            .filter(id__in=Subquery(first_members))
+            .select_related("user")
+            .order_by("id")
+        )
+        return queryset.annotate(
+            members_count=Count("members", distinct=True)
+        ).prefetch_related(
+            Prefetch("eventmember_set", queryset=members, to_attr="first_members")
+        )
+
     def get_members(self, obj):
-        return [StudentSerializer(m.user).data for m in obj.member.all()]
+        return StudentSerializer([m.user for m in obj.first_members], many=True, context=self.context).data
 
 
 class SectionDetailSerializer(serializers.ModelSerializer):
@@ -166,14 +260,27 @@ class SectionDetailSerializer(serializers.ModelSerializer):
         model = Section
         fields = "__all__"
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load all nested relations with constant number of queries"""
+        students = Student.objects.only(*StudentSerializer.Meta.fields)
+        return queryset.prefetch_related(
+            Prefetch("members", queryset=students),
+            Prefetch("trainers", queryset=Trainer.objects.only(*TrainerSerializer.Meta.fields)),
+            Prefetch(
+                "trainings",
+                queryset=SectionTraining.objects.prefetch_related(Prefetch("members", queryset=students))
+            ),
+        )
+
 
 class StudentDetailSerializer(serializers.ModelSerializer):
     photo = CustomBase64ImageField(represent_in_base64=True, required=False)
-    awards = serializers.SerializerMethodField()
+    awards = StudentAwardSerializer(many=True, read_only=True, source="verified_awards")
     sections = serializers.SerializerMethodField()
     trainings = serializers.SerializerMethodField()
-    events = EventMemberSerializer(many=True, read_only=True, source="event")
-    pass_trainings_count = serializers.SerializerMethodField()
+    events = EventMemberSerializer(many=True, read_only=True, source="eventmember_set")
+    pass_trainings_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Student
@@ -184,22 +291,52 @@ class StudentDetailSerializer(serializers.ModelSerializer):
             "pass_trainings_count", "awards"
         )
 
-    def get_pass_trainings_count(self, obj):
-        return obj.training.filter(training__is_active=False).count()
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Annotate counters and prefetch relations of student,
+        so profile is built with fixed number of queries"""
+        count_members = (
+            SectionMember.objects
+            .filter(section=OuterRef("section"))
+            .order_by()
+            .values("section")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        section_members = (
+            SectionMember.objects
+            .select_related("section")
+            .only("user", "rating", "pass_trainings", "section__id", "section__title")
+            .annotate(count_members=Subquery(count_members))
+        )
+        return queryset.annotate(
+            pass_trainings_count=Count(
+                "trainingmember",
+                filter=Q(trainingmember__training__is_active=False)
+            )
+        ).prefetch_related(
+            Prefetch("section", queryset=section_members),
+            Prefetch("awards", queryset=StudentAward.objects.filter(verified=True), to_attr="verified_awards"),
+            "eventmember_set",
+        )
 
     def get_sections(self, obj):
-        queryset = Section.objects.filter(id__in=obj.section.values_list("section"))
         sections = [{
-            "id": section.id,
-            "title": section.title,
-            "count_members": section.member.count(),
-            "rating": section.member.get(user=obj).rating,
-            "pass_trainings_count": section.member.get(user=obj).pass_trainings
-        } for section in queryset]
+            "id": member.section.id,
+            "title": member.section.title,
+            "count_members": member.count_members,
+            "rating": member.rating,
+            "pass_trainings_count": member.pass_trainings
+        } for member in obj.section.all()]
         return sections
 
     def get_trainings(self, obj):
-        queryset = SectionTraining.objects.filter(section__in=obj.section.values_list("section"), is_active=True)
+        section_ids = [member.section_id for member in obj.section.all()]
+        queryset = (
+            SectionTraining.objects
+            .filter(section__in=section_ids, is_active=True)
+            .only("id", "place", "datetime")
+        )
         trainings = [{
             "id": training.id,
             "place": training.place,
@@ -207,10 +344,66 @@ class StudentDetailSerializer(serializers.ModelSerializer):
         } for training in queryset]
         return trainings
 
-    def get_awards(self, obj):
-        queryset = obj.awards.filter(verified=True)
-        serializer = StudentAwardSerializer(queryset, many=True)
-        return serializer.data
+
+class SectionChangeSerializer(serializers.ModelSerializer):
+    image = CustomBase64ImageField(represent_in_base64=True, required=False)
+
+    class Meta:
+        model = Section
+        fields = ("id", "title", "description", "image", "trainers", "updated_at")
+
+
+class TrainingChangeSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SectionTraining
+        exclude = ("members",)
+
+
+class EventChangeSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SectionEvent
+        exclude = ("members",)
+
+
+class ChangesSerializer(serializers.Serializer):
+    """Cursor returned by previous request or `since` time for first one"""
+    cursor = serializers.CharField(required=False)
+    since = serializers.DateTimeField(required=False)
+
+
+class RosterSerializer(serializers.Serializer):
+    """Diff of members list: ids of students to add and to remove"""
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=500)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=500)
+
+    def validate(self, data):
+        if set(data["add"]) & set(data["remove"]):
+            raise serializers.ValidationError("Студент не может быть одновременно добавлен и удален")
+        return data
+
+
+class AttendanceOperationSerializer(serializers.Serializer):
+    """Operation on members of training (by uuid) or event made by client offline"""
+    id = serializers.UUIDField()
+    training = serializers.UUIDField(required=False)
+    event = serializers.IntegerField(required=False)
+    user = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=AttendanceChange.ACTION_CHOICES)
+    timestamp = serializers.DateTimeField()
+
+    def validate(self, data):
+        if bool(data.get("training")) == bool(data.get("event")):
+            raise serializers.ValidationError("Должна быть указана тренировка или мероприятие")
+        return data
+
+
+class AttendanceSyncSerializer(serializers.Serializer):
+    cursor = serializers.IntegerField(required=False, default=0, min_value=0)
+    operations = serializers.ListField(
+        child=AttendanceOperationSerializer(), required=False, default=list, max_length=1000
+    )
 
 
 class LoginSerializer(serializers.Serializer):
@@ -220,7 +413,11 @@ class LoginSerializer(serializers.Serializer):
     )
 
     def validate(self, data):
-        user = authenticate(**data)
+        user = authenticate_password(data["email"], data["password"])
         if user and user.is_active:
+            login_failures_limit.reset(account_ident(data["email"]))
             return user
+        login_failures_limit.hit(account_ident(data["email"]))
+        if "request" in self.context:
+            login_ip_limit.hit(client_ident(self.context["request"]))
         raise serializers.ValidationError('Incorrect Credentials Passed.')
@@ -1,9 +1,24 @@
-from django.db.models.signals import pre_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.conf import settings
+from django.utils import timezone
+from knox.models import AuthToken
 
-from .models import StudentAward
+from .models import (
+    User, Student, Trainer, Admin, StudentAward, OutboxEmail, Tombstone,
+    Section, SectionMember, SectionEvent, EventMember, SectionTraining, TrainingMember,
+)
 from .email import AwardSuccessVerified
+from .images import IMAGE_FIELDS, rendition_name
+from .tasks import (
+    generate_renditions, send_outbox_emails,
+    schedule_settlement, cancel_settlement, settlement_time,
+)
+from .leaderboard import Leaderboard
+from .changes import MODEL_FEEDS
+from .cache import invalidate
+from .authentication import evict_token
 
 
 @receiver(pre_save, sender=StudentAward)
@@ -16,4 +31,153 @@ def on_award_update(sender, instance, **kwargs):
     if previous.verified != current.verified and current.verified == True:
         context = {"award_title": instance.title, "domain": settings.SITE_DOMAIN}
         to = [instance.user.email]
-        AwardSuccessVerified(context=context).send(to)
+        # Key is unique per verification, change time of unverified award tells
+        # verification after un-verifying apart from retry of the same one
+        key = f"award-verified:{instance.pk}:{previous.updated_at.isoformat()}"
+        OutboxEmail.enqueue(AwardSuccessVerified, to, context, key=key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Trainer)
+@receiver(post_save, sender=Admin)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=StudentAward)
+def on_image_save(sender, instance, update_fields=None, **kwargs):
+    model = instance._meta.concrete_model._meta.label
+    field = IMAGE_FIELDS[model]
+    if update_fields and field not in update_fields:
+        return
+
+    file = getattr(instance, field)
+    if not file or file.storage.exists(rendition_name(file.name, "small")):
+        return
+    transaction.on_commit(lambda: generate_renditions.delay(model, instance.pk))
+
+
+@receiver(post_save, sender=SectionMember)
+def on_section_member_save(sender, instance, created, **kwargs):
+    if created:
+        board = Leaderboard(instance.section_id)
+        transaction.on_commit(lambda: board.update({instance.user_id: instance.rating}))
+
+
+@receiver(post_delete, sender=SectionMember)
+def on_section_member_delete(sender, instance, **kwargs):
+    board = Leaderboard(instance.section_id)
+    transaction.on_commit(lambda: board.remove(instance.user_id))
+
+
+SETTLEMENT_KINDS = {
+    SectionTraining: "training",
+    SectionEvent: "event",
+}
+
+
+@receiver(pre_save, sender=SectionTraining)
+@receiver(pre_save, sender=SectionEvent)
+def on_schedule_update(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+
+    previous = sender.objects.filter(pk=instance.pk).first()
+    if previous is None:
+        return
+    previous = settlement_time(previous)
+    if previous != settlement_time(instance):
+        kind, pk = SETTLEMENT_KINDS[sender], instance.pk
+        transaction.on_commit(lambda: cancel_settlement(kind, pk, previous))
+
+
+@receiver(post_save, sender=SectionTraining)
+@receiver(post_save, sender=SectionEvent)
+def on_schedule_save(sender, instance, update_fields=None, **kwargs):
+    if not instance.is_active or (update_fields and not {"datetime", "duration"} & set(update_fields)):
+        return
+
+    kind, pk, when = SETTLEMENT_KINDS[sender], instance.pk, settlement_time(instance)
+    transaction.on_commit(lambda: schedule_settlement(kind, pk, when))
+
+
+@receiver(post_delete, sender=SectionTraining)
+@receiver(post_delete, sender=SectionEvent)
+def on_schedule_delete(sender, instance, **kwargs):
+    kind, pk, when = SETTLEMENT_KINDS[sender], instance.pk, settlement_time(instance)
+    transaction.on_commit(lambda: cancel_settlement(kind, pk, when))
+
+
+@receiver(post_save, sender=OutboxEmail)
+def on_outbox_email_save(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(send_outbox_emails.delay)
+
+
+@receiver(post_delete, sender=Section)
+@receiver(post_delete, sender=SectionMember)
+@receiver(post_delete, sender=SectionTraining)
+@receiver(post_delete, sender=TrainingMember)
+@receiver(post_delete, sender=SectionEvent)
+@receiver(post_delete, sender=EventMember)
+def on_synced_delete(sender, instance, **kwargs):
+    Tombstone.objects.create(model=MODEL_FEEDS[sender], object_id=instance.pk)
+
+
+@receiver(m2m_changed, sender=Section.trainers.through)
+def on_section_trainers_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # On clear sections of trainer are known only before it
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        sections = Section.objects.filter(trainers=instance) if action == "pre_clear" else Section.objects.filter(pk__in=pk_set)
+    else:
+        sections = Section.objects.filter(pk=instance.pk)
+    sections.update(updated_at=timezone.now())
+
+
+CACHE_DEPENDENCIES = {
+    Section: ("sections", "sections_detail", "trainers"),
+    SectionMember: ("sections", "sections_detail", "trainers", "rating"),
+    SectionTraining: ("sections_detail",),
+    TrainingMember: ("sections_detail",),
+    User: ("sections_detail", "trainers", "rating"),
+    Student: ("sections_detail", "trainers", "rating"),
+    Trainer: ("sections_detail", "trainers", "rating"),
+    Admin: ("sections_detail", "trainers", "rating"),
+}
+
+CACHE_IGNORED_FIELDS = {"last_login", "password"}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+@receiver(post_save, sender=Trainer)
+@receiver(post_delete, sender=Trainer)
+@receiver(post_save, sender=Admin)
+@receiver(post_delete, sender=Admin)
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+@receiver(post_save, sender=SectionMember)
+@receiver(post_delete, sender=SectionMember)
+@receiver(post_save, sender=SectionTraining)
+@receiver(post_delete, sender=SectionTraining)
+@receiver(post_save, sender=TrainingMember)
+@receiver(post_delete, sender=TrainingMember)
+def on_cached_change(sender, update_fields=None, **kwargs):
+    # Logins save last_login and rehashed password, which are not in responses
+    if update_fields and set(update_fields) <= CACHE_IGNORED_FIELDS:
+        return
+    groups = CACHE_DEPENDENCIES[sender]
+    transaction.on_commit(lambda: invalidate(*groups))
+
+
+@receiver(m2m_changed, sender=Section.trainers.through)
+def on_section_trainers_cached_change(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(lambda: invalidate("sections_detail", "trainers"))
+
+
+@receiver(post_delete, sender=AuthToken)
+def on_auth_token_delete(sender, instance, **kwargs):
+    evict_token(instance.digest)
@@ -1,34 +1,193 @@
+from django.apps import apps
+from django.conf import settings
 from django.utils import timezone
+from redis.exceptions import RedisError
 
 from celery.utils.log import get_task_logger
+from kombu.exceptions import OperationalError
 
-from sporthack.celery import app
-from .models import SectionEvent, SectionTraining, SectionMember
+from sporthack.celery import app, singleton
+from sporthack.redis_client import get_redis
+from .models import SectionEvent, SectionTraining, Tombstone, AttendanceChange
+from .ratings import settle_batch, settle_trainings
+from .leaderboard import Leaderboard, rebuild_leaderboards as rebuild_all_leaderboards
+from .cache import invalidate
+from .images import IMAGE_FIELDS, create_renditions
+from .outbox import send_pending
+from .authentication import flush_refreshes, purge_expired
 
 logger = get_task_logger(__name__)
 
 
+def deactivate_events(**lookups):
+    now = timezone.now()
+    SectionEvent.objects.filter(datetime__lte=now, is_active=True, **lookups).update(is_active=False, updated_at=now)
+
+
 @app.task
+@singleton()
 def update_trainings():
-    queryset = SectionEvent.objects.filter(datetime__lte=timezone.now()).update(is_active=False)
-    queryset = SectionTraining.objects.filter(datetime__lte=timezone.now(), is_active=True)
-    for training in queryset:
-        # Update general user rating
-        training_members = training.member.all()
-        for member in training_members:
-            member.user.rating = member.user.rating + training.duration
-            member.user.save()
-        # Update section member rating
-        section_members = SectionMember.objects.filter(section=training.section)
-        training_user_ids = training.member.values_list("user", flat=True)
-        section_members = section_members.filter(user__in=training_user_ids)
-        for member in section_members:
-            member.rating = member.rating + training.duration
-            member.pass_trainings += 1
-            member.save()
-    queryset.update(is_active=False)
+    deactivate_events()
+    settled = settle_trainings()
+    logger.info(f"Settled {settled} trainings")
 
 
 @app.task
+@singleton()
 def update_events():
-    queryset = SectionEvent.objects.filter(datetime__lte=timezone.now()).update(is_active=False)
+    deactivate_events()
+
+
+@app.task
+@singleton()
+def settle_training(pk):
+    settled = settle_batch(ids=[pk])
+    logger.info(f"Settled training: {pk}" if settled else f"Training: {pk} is not due")
+
+
+@app.task
+@singleton()
+def settle_event(pk):
+    deactivate_events(pk=pk)
+
+
+SETTLEMENT_TASKS = {
+    "training": settle_training,
+    "event": settle_event,
+}
+
+
+def settlement_time(instance):
+    """Trainings are settled when they end, events when they start"""
+    if isinstance(instance, SectionTraining):
+        return instance.ends_at
+    return instance.datetime
+
+
+def settlement_task_id(kind, pk, when):
+    return f"settle-{kind}-{pk}-{int(when.timestamp())}"
+
+
+def schedule_settlement(kind, pk, when):
+    """Schedule settlement of training or event at `when`.
+    Only datetimes inside SETTLEMENT_HORIZON are scheduled, the rest
+    are picked up later by `sweep_settlements`"""
+    if when - timezone.now() > settings.SETTLEMENT_HORIZON:
+        return
+    task_id = settlement_task_id(kind, pk, when)
+    try:
+        ttl = int(settings.SETTLEMENT_HORIZON.total_seconds()) * 2
+        if not get_redis().set(f"settlement:{task_id}", 1, nx=True, ex=ttl):
+            return
+    except RedisError:
+        logger.warning(f"Settlement {task_id} is not deduplicated", exc_info=True)
+    try:
+        SETTLEMENT_TASKS[kind].apply_async(args=(pk,), eta=when, task_id=task_id)
+    except OperationalError:
+        logger.warning(f"Settlement {task_id} is left to sweeper", exc_info=True)
+
+
+def cancel_settlement(kind, pk, when):
+    """Revoke settlement scheduled at `when`.
+    Settlement tasks check datetime on run, so missed revoke is harmless"""
+    task_id = settlement_task_id(kind, pk, when)
+    try:
+        app.control.revoke(task_id)
+        get_redis().delete(f"settlement:{task_id}")
+    except (OperationalError, RedisError):
+        logger.warning(f"Settlement {task_id} is not unscheduled", exc_info=True)
+
+
+@app.task
+@singleton()
+def sweep_settlements():
+    """Settle missed trainings and events, schedule upcoming ones"""
+    update_trainings()
+    now = timezone.now()
+    horizon = now + settings.SETTLEMENT_HORIZON
+    upcoming = {
+        "training": (
+            SectionTraining.objects.with_end()
+            .filter(is_active=True, end_datetime__gt=now, end_datetime__lte=horizon)
+            .values_list("id", "end_datetime")
+        ),
+        "event": (
+            SectionEvent.objects
+            .filter(is_active=True, datetime__gt=now, datetime__lte=horizon)
+            .values_list("id", "datetime")
+        ),
+    }
+    for kind, queryset in upcoming.items():
+        for pk, when in queryset:
+            schedule_settlement(kind, pk, when)
+
+
+@app.task
+@singleton()
+def rebuild_leaderboards():
+    rebuild_all_leaderboards()
+
+
+@app.task
+@singleton()
+def rebuild_leaderboard(section=None):
+    """Rebuild board found missing by reads or updates"""
+    Leaderboard(section).rebuild()
+    invalidate("rating")
+
+
+@app.task
+@singleton()
+def generate_renditions(model, pk, force=False):
+    """Generate thumbnails of image field of `model` instance"""
+    Model = apps.get_model(model)
+    field = IMAGE_FIELDS[model]
+    try:
+        instance = Model.objects.only(field).get(pk=pk)
+    except Model.DoesNotExist:
+        return []
+    created = create_renditions(getattr(instance, field), force=force)
+    logger.info(f"Created {len(created)} renditions for {model}: {pk}")
+    return created
+
+
+@app.task
+@singleton()
+def send_outbox_emails():
+    sent = send_pending()
+    if sent:
+        logger.info(f"Sent {sent} emails")
+
+
+@app.task
+@singleton()
+def purge_tombstones():
+    """Delete tombstones older than TOMBSTONE_TTL, clients with older
+    cursor get full snapshot of data instead"""
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - settings.TOMBSTONE_TTL).delete()
+    logger.info(f"Purged {deleted} tombstones")
+
+
+@app.task
+@singleton()
+def purge_attendance_changes():
+    """Delete journal records older than ATTENDANCE_CHANGES_TTL"""
+    deleted, _ = AttendanceChange.objects.filter(
+        created_at__lt=timezone.now() - settings.ATTENDANCE_CHANGES_TTL
+    ).delete()
+    logger.info(f"Purged {deleted} attendance changes")
+
+
+@app.task
+@singleton()
+def flush_token_refreshes():
+    refreshed = flush_refreshes()
+    if refreshed:
+        logger.info(f"Refreshed expiry of {refreshed} tokens")
+
+
+@app.task
+@singleton()
+def purge_expired_auth():
+    sessions, tokens = purge_expired()
+    logger.info(f"Purged {sessions} sessions and {tokens} tokens")
@@ -1 +1,363 @@
-from django.test import TestCase
+import threading
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .cache import GROUPS, _generation_key
+from .filters import SectionEventFilterSerializer
+from .schedule import StudentCalendar, calendar_token
+from .models import (
+    Student, Trainer, Section, SectionMember, SectionTraining, TrainingMember, SectionEvent, EventMember,
+    AttendanceChange,
+)
+
+LOCAL_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_sections(count, trainer, students):
+    """Sections with members, trainer and training attended by students"""
+    sections = []
+    for i in range(count):
+        section = Section.objects.create(title=f"Секция {Section.objects.count()}", description="Описание")
+        section.trainers.add(trainer)
+        SectionMember.objects.bulk_create([SectionMember(section=section, user=student) for student in students])
+        training = SectionTraining.objects.create(
+            section=section, datetime=timezone.now() + timedelta(days=1), place="Зал", duration=60
+        )
+        TrainingMember.objects.bulk_create([TrainingMember(training=training, user=student) for student in students])
+        sections.append(section)
+    return sections
+
+
+@override_settings(CACHES=LOCAL_CACHE, IMAGE_REPRESENTATION="none")
+class SectionQueryBudgetTest(TestCase):
+    """Sections are read by constant number of queries however many there are"""
+    # ETag state queries, sections and one query per prefetched relation
+    SECTIONS_QUERIES = 11
+    SECTION_QUERIES = 10
+
+    def setUp(self):
+        self.trainer = Trainer.objects.create(email="trainer@example.com", first_name="Иван", last_name="Иванов")
+        self.students = [
+            Student.objects.create(email=f"student{i}@example.com", first_name="Петр", last_name=f"Петров{i}")
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.students[0])
+
+    def test_sections(self):
+        for count in (2, 20):
+            create_sections(count - Section.objects.count(), self.trainer, self.students)
+            # Invalidation runs on commit, which never happens in TestCase
+            cache.clear()
+            with self.assertNumQueries(self.SECTIONS_QUERIES):
+                response = self.client.get("/api/sections/", {"page_size": 100})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), count)
+
+    def test_section(self):
+        for count in (2, 20):
+            sections = create_sections(count, self.trainer, self.students)
+            with self.assertNumQueries(self.SECTION_QUERIES):
+                response = self.client.get(f"/api/section/{sections[-1].pk}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["members"]), len(self.students))
+
+
+@override_settings(CACHES=LOCAL_CACHE, IMAGE_REPRESENTATION="none")
+class SectionEventFilterTest(TestCase):
+    VALUES = {
+        "level": "city",
+        "section": 1,
+        "is_active": True,
+        "date_from": "2022-01-01T00:00:00Z",
+        "date_to": "2022-02-01T00:00:00Z",
+    }
+
+    def setUp(self):
+        student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        section = Section.objects.create(title="Секция", description="Описание")
+        for i, (level, _) in enumerate(SectionEvent.LEVEL_CHOICES):
+            SectionEvent.objects.create(
+                section=section, title=f"Мероприятие {i}", level=level, place="Стадион",
+                datetime=timezone.now() + timedelta(days=i), is_active=i % 2 == 0
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(student)
+
+    def test_filters_use_index(self):
+        """Query plan of every whitelisted filter with ordering of pagination
+        reads events by index. Postgres is told to avoid sequential scans,
+        so index is chosen on small test table if it can be used at all"""
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        elif connection.vendor != "sqlite":
+            self.skipTest(f"Query plan of {connection.vendor} is not checked")
+
+        lookups = SectionEventFilterSerializer.Meta.lookups
+        self.assertEqual(set(lookups), set(self.VALUES))
+        for field, lookup in lookups.items():
+            serializer = SectionEventFilterSerializer(data={field: self.VALUES[field]})
+            serializer.is_valid(raise_exception=True)
+            queryset = SectionEvent.objects.filter(**{lookup: serializer.validated_data[field]}).order_by("datetime", "id")
+            plan = queryset.explain()
+            with self.subTest(field=field, plan=plan):
+                if connection.vendor == "postgresql":
+                    self.assertIn("Index Cond", plan)
+                else:
+                    self.assertRegex(plan, r"USING (COVERING )?INDEX")
+
+    def test_unknown_filters_are_ignored(self):
+        expected = SectionEvent.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            get = self.client.get("/api/events/", {"members__password": "x", "page_size": 100})
+            post = self.client.post("/api/events/?page_size=100", {"members__password": "x"}, format="json")
+        for response in (get, post):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), expected)
+        for query in queries.captured_queries:
+            self.assertNotRegex(query["sql"], r'"password" (=|IN|LIKE)')
+
+    def test_post_filters_are_kept_in_page_links(self):
+        response = self.client.post("/api/events/?page_size=1", {"is_active": True}, format="json")
+        active = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            active += [event["is_active"] for event in response.data["results"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(len(active), SectionEvent.objects.filter(is_active=True).count())
+        self.assertTrue(all(active))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class TrainingCheckInTest(TransactionTestCase):
+    """Everyone scans QR code of training at once, retries included"""
+    CHECK_INS = 20
+
+    def setUp(self):
+        self.student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        section = Section.objects.create(title="Секция", description="Описание")
+        self.training = SectionTraining.objects.create(
+            section=section, datetime=timezone.now() + timedelta(hours=1), place="Зал", duration=60
+        )
+
+    def check_in(self, training_uuid):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        return client.get(f"/api/training/create-member/{training_uuid}")
+
+    def test_parallel_check_ins(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Shared in-memory sqlite database locks tables of concurrent writers")
+        barrier = threading.Barrier(self.CHECK_INS)
+        statuses = []
+
+        def scan():
+            try:
+                barrier.wait()
+                statuses.append(self.check_in(self.training.uuid).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=scan) for _ in range(self.CHECK_INS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [201] * self.CHECK_INS)
+        self.assertEqual(TrainingMember.objects.filter(training=self.training, user=self.student).count(), 1)
+        self.assertEqual(AttendanceChange.objects.filter(training=self.training, user=self.student).count(), 1)
+
+    def test_unknown_training(self):
+        response = self.check_in(uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["error"], "training_not_found")
+
+
+class CalendarFeedASGITest(TestCase):
+    """Feed is served by ASGI handler, which iterates response in event loop"""
+
+    def setUp(self):
+        self.student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        section = Section.objects.create(title="Секция", description="Описание")
+        SectionMember.objects.create(section=section, user=self.student)
+        for i in range(3):
+            SectionTraining.objects.create(
+                section=section, datetime=timezone.now() + timedelta(days=i), place="Зал", duration=60
+            )
+        event = SectionEvent.objects.create(
+            section=section, title="Мероприятие", level="city", place="Стадион", datetime=timezone.now()
+        )
+        EventMember.objects.create(event=event, user=self.student)
+        # Like test client, handler must not close connection of test transaction
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def asgi_get(self, path):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+        }
+        async_to_sync(ASGIHandler())(scope, receive, send)
+        status = next(message["status"] for message in messages if message["type"] == "http.response.start")
+        body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+        return status, body.decode()
+
+    def test_feed(self):
+        status, body = self.asgi_get(f"/api/calendar/{calendar_token(self.student)}.ics")
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR"))
+        self.assertTrue(body.endswith("END:VCALENDAR\r\n"))
+        self.assertEqual(body.count("BEGIN:VEVENT"), 4)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class LoginTest(TestCase):
+
+    def test_login_keeps_generations(self):
+        student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        student.set_password("password")
+        student.save()
+        keys = [_generation_key(group) for group in GROUPS]
+        cache.set_many({key: 1 for key in keys}, timeout=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                "/auth/token/login/", {"email": student.email, "password": "password"}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get_many(keys), {key: 1 for key in keys})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            student.first_name = "Павел"
+            student.save()
+        self.assertNotEqual(cache.get(_generation_key("sections_detail")), 1)
+
+    def test_login_with_array_body(self):
+        response = APIClient().post("/auth/token/login/", [1, 2], format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHE, IMAGE_REPRESENTATION="none")
+class TrainerScopeTest(TestCase):
+    """Trainers change members only of their own sections"""
+
+    def setUp(self):
+        self.trainer = Trainer.objects.create(email="trainer@example.com", first_name="Иван", last_name="Иванов")
+        self.foreign_trainer = Trainer.objects.create(email="other@example.com", first_name="Олег", last_name="Олегов")
+        self.student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        self.section = Section.objects.create(title="Секция", description="Описание")
+        self.section.trainers.add(self.trainer)
+        self.training = SectionTraining.objects.create(
+            section=self.section, datetime=timezone.now(), place="Зал", duration=60
+        )
+        self.event = SectionEvent.objects.create(
+            section=self.section, title="Мероприятие", level="city", place="Стадион", datetime=timezone.now()
+        )
+
+    def client_of(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def sync(self, trainer):
+        operations = [
+            {"id": str(uuid.uuid4()), "training": str(self.training.uuid), "user": self.student.id,
+             "action": "add", "timestamp": timezone.now().isoformat()},
+            {"id": str(uuid.uuid4()), "event": self.event.id, "user": self.student.id,
+             "action": "add", "timestamp": timezone.now().isoformat()},
+        ]
+        response = self.client_of(trainer).post("/api/attendance/sync", {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return operations, response.data
+
+    def test_attendance_sync_of_foreign_sections_is_forbidden(self):
+        operations, data = self.sync(self.foreign_trainer)
+        self.assertEqual(data["applied"], [])
+        self.assertEqual(data["rejected"], [{"id": uuid.UUID(op["id"]), "error": "forbidden"} for op in operations])
+        self.assertFalse(TrainingMember.objects.exists())
+        self.assertFalse(EventMember.objects.exists())
+
+        operations, data = self.sync(self.trainer)
+        self.assertEqual(data["applied"], [op["id"] for op in operations])
+        self.assertTrue(TrainingMember.objects.filter(training=self.training, user=self.student).exists())
+        self.assertTrue(EventMember.objects.filter(event=self.event, user=self.student).exists())
+
+    def test_roster_of_foreign_sections_is_forbidden(self):
+        urls = [
+            f"/api/section/{self.section.pk}/roster",
+            f"/api/training/{self.training.pk}/roster",
+            f"/api/event/{self.event.pk}/roster",
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client_of(self.foreign_trainer).post(url, {"add": [self.student.id]}, format="json")
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(response.data["error"], "forbidden")
+        self.assertFalse(SectionMember.objects.exists())
+        self.assertFalse(TrainingMember.objects.exists())
+        self.assertFalse(EventMember.objects.exists())
+
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client_of(self.trainer).post(url, {"add": [self.student.id]}, format="json")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([student["id"] for student in response.data], [self.student.id])
+
+
+class CalendarVersionTest(TestCase):
+
+    def test_section_rename_changes_version(self):
+        student = Student.objects.create(email="student@example.com", first_name="Петр", last_name="Петров")
+        section = Section.objects.create(title="Секция", description="Описание")
+        SectionMember.objects.create(section=section, user=student)
+        SectionTraining.objects.create(section=section, datetime=timezone.now(), place="Зал", duration=60)
+        etag, _ = StudentCalendar(student).get_version()
+
+        section.title = "Новая секция"
+        section.save()
+        self.assertNotEqual(StudentCalendar(student).get_version()[0], etag)
+
+
+@override_settings(CACHES=LOCAL_CACHE, IMAGE_REPRESENTATION="none")
+class RatingTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            Trainer.objects.create(email="trainer@example.com", first_name="Иван", last_name="Иванов")
+        )
+
+    def test_empty_rating(self):
+        with mock.patch("api.tasks.rebuild_leaderboard.delay") as delay:
+            for url in ("/api/rating/", "/api/rating/?section=999"):
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data, [])
+        self.assertNotIn(mock.call(999), delay.call_args_list)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework.throttling import BaseThrottle
+
+from sporthack.redis_client import get_redis
+
+
+class RedisRateLimit:
+    """Fixed window counter in redis. Counting is atomic, so concurrent
+    requests can not get over the limit. Redis errors do not block requests"""
+
+    def __init__(self, prefix, limit, window):
+        self.prefix = prefix
+        self.limit = limit
+        self.window = window
+
+    def _key(self, ident):
+        return f"ratelimit:{self.prefix}:{ident}"
+
+    def hit(self, ident):
+        """Count attempt, return seconds to wait if limit is exceeded"""
+        try:
+            pipe = get_redis().pipeline()
+            pipe.set(self._key(ident), 0, ex=self.window, nx=True)
+            pipe.incr(self._key(ident))
+            pipe.ttl(self._key(ident))
+            _, count, ttl = pipe.execute()
+        except RedisError:
+            return None
+        return max(ttl, 1) if count > self.limit else None
+
+    def check(self, ident):
+        """Return seconds to wait if limit is exceeded, without counting"""
+        try:
+            pipe = get_redis().pipeline()
+            pipe.get(self._key(ident))
+            pipe.ttl(self._key(ident))
+            count, ttl = pipe.execute()
+        except RedisError:
+            return None
+        return max(ttl, 1) if count and int(count) >= self.limit else None
+
+    def reset(self, ident):
+        try:
+            get_redis().delete(self._key(ident))
+        except RedisError:
+            pass
+
+
+login_ip_limit = RedisRateLimit("login:ip", *settings.LOGIN_RATE_LIMITS["ip"])
+login_failures_limit = RedisRateLimit("login:account", *settings.LOGIN_RATE_LIMITS["account"])
+
+
+def account_ident(email):
+    return str(email).strip().lower()
+
+
+def client_ident(request):
+    """IP of client, proxies are resolved as by throttles"""
+    return BaseThrottle().get_ident(request)
+
+
+class LoginThrottle(BaseThrottle):
+    """Limits failed login attempts from one IP and for one account, so
+    password guessing is rejected before hashing. Successful logins are
+    not counted, so users behind one NAT are not blocked"""
+
+    def allow_request(self, request, view):
+        self.retry_after = login_ip_limit.check(self.get_ident(request))
+        if self.retry_after is None and isinstance(request.data, dict) and request.data.get("email"):
+            self.retry_after = login_failures_limit.check(account_ident(request.data["email"]))
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
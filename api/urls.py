@@ -1,27 +1,47 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import *
+from .async_views import async_view
+
+
+def read_view(view_class):
+    """Read-heavy views are served by async views in ASGI mode"""
+    if settings.SERVER_MODE == "asgi":
+        return async_view(view_class)
+    return view_class.as_view()
+
 
 urlpatterns = [
     path("user/edit", UserView.as_view(), name="user-edit"),
-    path("users/trainer/<int:pk>", TrainerView.as_view(), name="user-trainer"),
-    path("users/student/<int:pk>", StudentView.as_view(), name="user-student"),
-    path("users/student-detail/<int:pk>", StudentDetailView.as_view(), name="user-student-detail"),
-    path("rating/", StudentRatingListView.as_view(), name="rating"),
+    path("user/calendar", CalendarTokenView.as_view(), name="calendar-token"),
+    path("calendar/<str:token>.ics", CalendarFeedView.as_view(), name="calendar-feed"),
+    path("users/trainer/<int:pk>", read_view(TrainerView), name="user-trainer"),
+    path("users/student/<int:pk>", read_view(StudentView), name="user-student"),
+    path("users/student-detail/<int:pk>", read_view(StudentDetailView), name="user-student-detail"),
+    path("rating/", read_view(StudentRatingListView), name="rating"),
+    path("rating/me", StudentRankView.as_view(), name="rating-me"),
     path("awards/", StudentAwardCreateView.as_view(), name="awards"),
 
-    path("sections/", SectionDetailListView.as_view(), name="sections"),
-    path("sections-compress/", SectionListView.as_view(), name="sections-compress"),
-    path("section/<int:pk>", SectionView.as_view(), name="section"),
+    path("sections/", read_view(SectionDetailListView), name="sections"),
+    path("sections-compress/", read_view(SectionListView), name="sections-compress"),
+    path("section/<int:pk>", read_view(SectionView), name="section"),
     path("section/create-member", SectionMemberCreateView.as_view(), name="create-section-member"),
     path("section/delete-member", SectionMemberDeleteView.as_view(), name="delete-section-member"),
+    path("section/<int:pk>/roster", SectionRosterView.as_view(), name="section-roster"),
 
-    path("trainings/<int:pk>", SectionTrainingListView.as_view(), name="trainings"),
-    path("trainings-date/", SectionTrainingListView.as_view(), name="training-date"),
-    path("training/create-member/<str:uuid>", TrainingMemberCreateView.as_view(), name="create-training-member"),
+    path("trainings/<int:pk>", read_view(SectionTrainingListView), name="trainings"),
+    path("trainings-date/", read_view(TrainingDateListView), name="training-date"),
+    path("trainings/calendar", TrainingCalendarView.as_view(), name="trainings-calendar"),
+    path("training/create-member/<uuid:uuid>", TrainingMemberCreateView.as_view(), name="create-training-member"),
     path("training/delete-member/<int:pk>", TrainingMemberDeleteView.as_view(), name="delete-training-member"),
+    path("training/<int:pk>/roster", TrainingRosterView.as_view(), name="training-roster"),
 
-    path("events/", SectionEventListView.as_view(), name="events"),
+    path("events/", read_view(SectionEventListView), name="events"),
+    path("event/<int:pk>/members", read_view(EventMemberListView), name="event-members"),
+    path("event/<int:pk>/roster", EventRosterView.as_view(), name="event-roster"),
+    path("attendance/sync", AttendanceSyncView.as_view(), name="attendance-sync"),
+    path("changes", ChangesView.as_view(), name="changes"),
     path("event/create-member", EventMemberCreateView.as_view(), name="create-event-member"),
     path("event/delete-member", EventMemberDeleteView.as_view(), name="delete-event-member")
 ]
@@ -0,0 +1,180 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import (
+    User, StudentAward, Section, SectionMember, SectionTraining,
+    TrainingMember, SectionEvent, EventMember, Tombstone,
+)
+from .changes import CHANGES_LAG, MODEL_FEEDS
+
+
+def state(queryset, field="updated_at"):
+    """Number of rows and time of last change of queryset.
+    Count changes on delete, time changes on insert and update"""
+    values = queryset.order_by().aggregate(count=Count("pk"), last=Max(field))
+    return values["count"], values["last"]
+
+
+def last_change(*models):
+    """Time of last change of every model, deletes are taken
+    from tombstones, so whole table is not counted"""
+    deleted = dict(
+        Tombstone.objects
+        .filter(model__in=[MODEL_FEEDS[model] for model in models])
+        .values_list("model")
+        .annotate(last=Max("deleted_at"))
+        .order_by()
+    )
+    return [
+        (model.objects.aggregate(last=Max("updated_at"))["last"], deleted.get(MODEL_FEEDS[model]))
+        for model in models
+    ]
+
+
+def _last(parts):
+    """Latest time in nested parts of state"""
+    times = [
+        part if isinstance(part, datetime) else _last(part)
+        for part in parts if isinstance(part, (datetime, tuple, list))
+    ]
+    times = [time for time in times if time is not None]
+    return max(times) if times else None
+
+
+def make_etag(request, *parts):
+    """ETag of representation of data in `parts` state. Query params
+    select images representation and page, so they are part of it.
+    Rows are stamped before their transaction commits, so state changed
+    during CHANGES_LAG may still change without moving max time, then
+    no ETag is returned and response is not validated by client"""
+    last = _last(parts)
+    if last is not None and last > timezone.now() - CHANGES_LAG:
+        return None
+    key = f"{request.get_full_path()}:{settings.IMAGE_REPRESENTATION}:{parts}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def per_request(etag_func):
+    """Compute ETag once per request, so conditional view and its
+    response cache (which keys cached data by ETag) share one value"""
+    @wraps(etag_func)
+    def wrapper(request, *args, **kwargs):
+        etags = getattr(request, "_etags", None)
+        if etags is None:
+            etags = request._etags = {}
+        if etag_func not in etags:
+            etags[etag_func] = etag_func(request, *args, **kwargs)
+        return etags[etag_func]
+    return wrapper
+
+
+@per_request
+def student_etag(request, pk):
+    student = User.objects.filter(pk=pk, is_trainer=False).values_list("updated_at", flat=True).first()
+    if student is None:
+        return None
+    return make_etag(request, student)
+
+
+@per_request
+def student_detail_etag(request, pk):
+    student = User.objects.filter(pk=pk, is_trainer=False).values_list("updated_at", flat=True).first()
+    if student is None:
+        return None
+    sections = SectionMember.objects.filter(user=pk).values("section")
+    return make_etag(
+        request,
+        student,
+        state(Section.objects.filter(id__in=sections)),
+        state(SectionMember.objects.filter(section__in=sections)),
+        state(SectionTraining.objects.filter(section__in=sections)),
+        state(TrainingMember.objects.filter(user=pk)),
+        state(EventMember.objects.filter(user=pk)),
+        state(StudentAward.objects.filter(user=pk)),
+    )
+
+
+@per_request
+def trainer_etag(request, pk):
+    trainer = User.objects.filter(pk=pk, is_trainer=True).values_list("updated_at", flat=True).first()
+    if trainer is None:
+        return None
+    return make_etag(
+        request,
+        trainer,
+        state(Section.objects.filter(trainers=pk)),
+        state(SectionMember.objects.filter(section__trainers=pk)),
+    )
+
+
+@per_request
+def section_etag(request, pk):
+    section = Section.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+    if section is None:
+        return None
+    return make_etag(
+        request,
+        section,
+        state(SectionMember.objects.filter(section=pk)),
+        state(SectionTraining.objects.filter(section=pk)),
+        state(TrainingMember.objects.filter(training__section=pk)),
+        User.objects.filter(
+            Q(member_sections=pk) | Q(sections=pk) | Q(trainings__section=pk)
+        ).aggregate(last=Max("updated_at"))["last"],
+    )
+
+
+@per_request
+def sections_etag(request, *args, **kwargs):
+    return make_etag(request, last_change(Section, SectionMember))
+
+
+@per_request
+def sections_detail_etag(request, *args, **kwargs):
+    return make_etag(
+        request,
+        last_change(Section, SectionMember, SectionTraining, TrainingMember),
+        User.objects.aggregate(last=Max("updated_at"))["last"],
+    )
+
+
+@per_request
+def section_trainings_etag(request, pk):
+    return make_etag(
+        request,
+        state(SectionTraining.objects.filter(section=pk)),
+        state(TrainingMember.objects.filter(training__section=pk)),
+        User.objects.filter(trainings__section=pk).aggregate(last=Max("updated_at"))["last"],
+    )
+
+
+@per_request
+def trainings_date_etag(request, *args, **kwargs):
+    return make_etag(
+        request,
+        last_change(SectionTraining, TrainingMember),
+        User.objects.aggregate(last=Max("updated_at"))["last"],
+    )
+
+
+@per_request
+def events_etag(request, *args, **kwargs):
+    return make_etag(
+        request,
+        last_change(SectionEvent, EventMember),
+        User.objects.aggregate(last=Max("updated_at"))["last"],
+    )
+
+
+@per_request
+def event_members_etag(request, pk):
+    return make_etag(
+        request,
+        state(EventMember.objects.filter(event=pk)),
+        User.objects.filter(events=pk).aggregate(last=Max("updated_at"))["last"],
+    )
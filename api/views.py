@@ -1,10 +1,16 @@
-import pytz
-from datetime import datetime
+from zoneinfo import ZoneInfo
 
-from django.contrib.auth import login
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Prefetch
 from django.utils import timezone
 from django.template.loader import get_template
-from django.http import HttpResponseNotFound
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from rest_framework.generics import (
     CreateAPIView,
     RetrieveAPIView,
@@ -16,7 +22,6 @@ from rest_framework.generics import (
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from knox.views import LoginView as KnoxLoginView
-from knox.auth import TokenAuthentication
 
 from .models import (
     User, 
@@ -31,19 +36,37 @@ from .serializers import (
     TrainerDetailSerializer, SectionSerializer, SectionDetailSerializer,
     SectionMemberSerializer, SectionEventSerializer,
     EventMemberSerializer, SectionTrainingSerializer, 
-    TrainingMemberSerializer, LoginSerializer
+    LoginSerializer, RosterSerializer,
+    AttendanceSyncSerializer, ChangesSerializer
 )
 from .permissions import IsTrainer
+from .attendance import record_changes, sync
+from .changes import changes, decode_cursor, since_positions
+from .authentication import CachedTokenAuthentication
+from .cache import cached_response, invalidate
+from .throttling import LoginThrottle
+from .versions import (
+    student_etag, student_detail_etag, trainer_etag,
+    section_etag, sections_etag, sections_detail_etag,
+    section_trainings_etag, trainings_date_etag, events_etag, event_members_etag,
+)
+from .leaderboard import Leaderboard
+from .pagination import CursorPagination, DatetimeCursorPagination
+from .filters import (
+    SerializerFilterBackend, SectionEventFilterSerializer,
+    TrainingCalendarSerializer, TrainingDateSerializer,
+)
+from .schedule import StudentCalendar, calendar_token, get_calendar_user, local_range
 
 
 class UserView(UpdateAPIView):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = [IsAuthenticated]
     queryset = User
     serializer_class = UserSerializer
 
     def update(self, request):
-        serializer = self.serializer_class(instance=request.user, data=request.data, partial=True)
+        serializer = self.serializer_class(instance=request.user, data=request.data, partial=True, context=self.get_serializer_context())
         if serializer.is_valid(raise_exception=False):
             serializer.update(request.user, serializer.validated_data)
             return Response(serializer.data, status=200)
@@ -56,12 +79,13 @@ class StudentView(RetrieveAPIView):
     queryset = Student
     serializer_class = StudentSerializer
 
+    @method_decorator(condition(etag_func=student_etag))
     def retrieve(self, request, pk):
         try:
             student = self.queryset.objects.get(id=pk)
         except Student.DoesNotExist:
             return Response(data={"description": f"Студент: {pk} не найден!", "error": "student_not_found"})
-        serializer = self.serializer_class(student)
+        serializer = self.serializer_class(student, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
 
@@ -70,17 +94,18 @@ class StudentDetailView(RetrieveAPIView):
     queryset = Student
     serializer_class = StudentDetailSerializer
 
+    @method_decorator(condition(etag_func=student_detail_etag))
     def retrieve(self, request, pk):
         try:
-            student = self.queryset.objects.get(id=pk)
+            student = self.serializer_class.setup_eager_loading(self.queryset.objects).get(id=pk)
         except Student.DoesNotExist:
             return Response(data={"description": f"Студент: {pk} не найден!", "error": "student_not_found"})
-        serializer = self.serializer_class(student)
+        serializer = self.serializer_class(student, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
 
 class StudentAwardCreateView(CreateAPIView):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = [IsAuthenticated]
     queryset = StudentAward
     serializer_class = StudentAwardSerializer
@@ -97,30 +122,74 @@ class StudentAwardCreateView(CreateAPIView):
 
 
 class StudentRatingListView(RetrieveAPIView):
+    """Top students by rating. With `section` param
+    returns top of section with section rating of students"""
     permission_classes = [IsAuthenticated]
     queryset = Student
     serializer_class = StudentSerializer
 
+    @cached_response("rating", "rating")
     def retrieve(self, request, *args, **kwargs):
-        try:
-            students = self.queryset.objects.order_by("-rating")[:10]
-        except Student.DoesNotExist:
-            return Response(data={"description": "Студенты не найдены!", "error": "students_not_found"}, status=404)
-        serializer = self.serializer_class(students, many=True)
+        section = request.query_params.get("section")
+        if section is not None and not section.isdigit():
+            return Response(data={"description": f"Секция: {section} не найдена!", "error": "section_not_found"}, status=404)
+
+        top = Leaderboard(section and int(section)).top(10)
+        students = self.queryset.objects.in_bulk([user for user, _ in top])
+        for user, score in top:
+            if user in students:
+                students[user].rating = score
+        students = [students[user] for user, _ in top if user in students]
+        serializer = self.serializer_class(students, many=True, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
 
+class StudentRankView(RetrieveAPIView):
+    """Rank of current student and his neighbours on global or section board"""
+    permission_classes = [IsAuthenticated]
+    queryset = Student
+    serializer_class = StudentSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        section = request.query_params.get("section")
+        if section is not None and not section.isdigit():
+            return Response(data={"description": f"Секция: {section} не найдена!", "error": "section_not_found"}, status=404)
+
+        board = Leaderboard(section and int(section))
+        position = board.rank(request.user.id)
+        if position is None:
+            return Response(data={"description": "Студент не участвует в рейтинге", "error": "student_not_rated"}, status=404)
+
+        count = request.query_params.get("count", "2")
+        count = min(int(count), 10) if count.isdigit() else 2
+        neighbours = board.around(request.user.id, count=count)
+        students = self.queryset.objects.in_bulk([user for _, user, _ in neighbours])
+        data = {
+            "rank": position[0],
+            "rating": position[1],
+            "neighbours": [{
+                "rank": rank,
+                "rating": score,
+                "user": self.serializer_class(students[user], context=self.get_serializer_context()).data
+            } for rank, user, score in neighbours if user in students]
+        }
+        return Response(data, status=200)
+
+
 class TrainerView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Trainer
     serializer_class = TrainerDetailSerializer
 
+    @method_decorator(condition(etag_func=trainer_etag))
+    @cached_response("trainer", "trainers", etag_func=trainer_etag)
     def retrieve(self, request, pk):
         try:
-            trainer = self.queryset.objects.get(id=pk)
+            sections = SectionSerializer.setup_eager_loading(Section.objects.all())
+            trainer = self.queryset.objects.prefetch_related(Prefetch("sections", queryset=sections)).get(id=pk)
         except Trainer.DoesNotExist:
             return Response(data={"description": f"Тренер: {pk} не найден!", "error": "trainer_not_found"}, status=404)
-        serializer = self.serializer_class(trainer)
+        serializer = self.serializer_class(trainer, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
 
@@ -128,30 +197,38 @@ class SectionListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Section
     serializer_class = SectionSerializer
+    pagination_class = CursorPagination
 
+    @method_decorator(condition(etag_func=sections_etag))
+    @cached_response("sections", "sections", etag_func=sections_etag)
     def get(self, request, *args, **kwargs):
         try:
-            sections = self.queryset.objects.all().only('id', 'title')
+            sections = self.serializer_class.setup_eager_loading(self.queryset.objects.all())
         except Section.DoesNotExist:
             return Response(data={"description": f"Секции не найдены", "error": "sections_not_found"}, status=404)
 
-        serializer = self.serializer_class(sections, many=True)
-        return Response(serializer.data, status=200)
+        page = self.paginate_queryset(sections)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
 class SectionDetailListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = Section
     serializer_class = SectionDetailSerializer
+    pagination_class = CursorPagination
 
+    @method_decorator(condition(etag_func=sections_detail_etag))
+    @cached_response("sections_detail", "sections_detail", etag_func=sections_detail_etag)
     def get(self, request, *args, **kwargs):
         try:
-            sections = self.queryset.objects.all()
+            sections = self.serializer_class.setup_eager_loading(self.queryset.objects.all())
         except Section.DoesNotExist:
             return Response(data={"description": f"Секции не найдены", "error": "sections_not_found"}, status=404)
 
-        serializer = self.serializer_class(sections, many=True)
-        return Response(serializer.data, status=200)
+        page = self.paginate_queryset(sections)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
 class SectionView(RetrieveUpdateDestroyAPIView):
@@ -159,12 +236,13 @@ class SectionView(RetrieveUpdateDestroyAPIView):
     queryset = Section
     serializer_class = SectionDetailSerializer
 
+    @method_decorator(condition(etag_func=section_etag))
     def retrieve(self, request, pk):
         try:
-            section = self.queryset.objects.get(id=pk)
+            section = self.serializer_class.setup_eager_loading(self.queryset.objects).get(id=pk)
         except Section.DoesNotExist:
             return Response(data={"description": f"Секция: {pk} не найдена!", "error": "section_not_found"}, status=404)
-        serializer = self.serializer_class(section)
+        serializer = self.serializer_class(section, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
     def update(self, request, pk):
@@ -172,7 +250,7 @@ class SectionView(RetrieveUpdateDestroyAPIView):
             section = self.queryset.objects.get(id=pk)
         except Section.DoesNotExist:
             return Response(data={"description": f"Секция: {pk} не найдена!", "error": "section_not_found"}, status=404)
-        serializer = self.serializer_class(section, data=request.data)
+        serializer = self.serializer_class(section, data=request.data, context=self.get_serializer_context())
         if serializer.is_valid(raise_exception=False):
             serializer.update(section, serializer.validated_data)
             return Response(serializer.data, status=200)
@@ -181,7 +259,7 @@ class SectionView(RetrieveUpdateDestroyAPIView):
 
 
 class SectionMemberCreateView(CreateAPIView):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = [IsAuthenticated]
     queryset = SectionMember
     serializer_class = SectionMemberSerializer
@@ -220,33 +298,126 @@ class SectionTrainingListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = SectionTraining
     serializer_class = SectionTrainingSerializer
+    pagination_class = DatetimeCursorPagination
 
+    @method_decorator(condition(etag_func=section_trainings_etag))
     def get(self, request, pk):
         try:
-            trainings = self.queryset.objects.filter(section=pk)
+            trainings = self.serializer_class.setup_eager_loading(self.queryset.objects.filter(section=pk))
         except SectionTraining.DoesNotExist:
             return Response(
                 data={"description": "Тренировки не найдены", 
                       "error": "trainings_not_found"}, 
                 status=404)
 
-        serializer = self.serializer_class(trainings, many=True)
-        return Response(serializer.data, status=200)
+        page = self.paginate_queryset(trainings)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class TrainingDateListView(ListAPIView):
+    """Trainings of local day `date` from query string. POST with `date`
+    in body is kept for old clients, its page links are GET requests"""
+    permission_classes = [IsAuthenticated]
+    queryset = SectionTraining
+    serializer_class = SectionTrainingSerializer
+    pagination_class = DatetimeCursorPagination
+
+    @method_decorator(condition(etag_func=trainings_date_etag))
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        date = request.data.get("date")
-        dt = datetime.strptime(date, "%Y-%m-%d")
-        dt = dt.astimezone(pytz.timezone("Europe/Moscow"))
-        try:
-            trainings = self.queryset.objects.filter(datetime__date=dt.date())
-        except SectionTraining.DoesNotExist:
-            return Response(
-                data={"description": "Тренировки не найдены", 
-                      "error": "trainings_not_found"}, 
-                status=404)
+        return self.list(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        params = TrainingDateSerializer(data=request.query_params if request.method == "GET" else request.data)
+        params.is_valid(raise_exception=True)
+        date = params.validated_data["date"]
+        self.link_params = {"date": date.isoformat()}
+
+        start, end = local_range(date, date)
+        trainings = self.queryset.objects.filter(datetime__gte=start, datetime__lt=end)
+        trainings = self.serializer_class.setup_eager_loading(trainings)
+        page = self.paginate_queryset(trainings)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class TrainingCalendarView(GenericAPIView):
+    """Trainings grouped by local day, without members"""
+    permission_classes = [IsAuthenticated]
+    queryset = SectionTraining
+    serializer_class = TrainingCalendarSerializer
+
+    def get(self, request, *args, **kwargs):
+        params = self.serializer_class(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        tz = ZoneInfo(params["tz"]) if "tz" in params else timezone.get_default_timezone()
+
+        start, end = local_range(params["date_from"], params["date_to"], tz)
+        trainings = self.queryset.objects.filter(datetime__gte=start, datetime__lt=end)
+        if "section" in params:
+            trainings = trainings.filter(section=params["section"])
+        trainings = trainings.order_by("datetime", "id").values(
+            "id", "section", "section__title", "datetime", "place", "duration", "is_active"
+        )
+
+        days = {}
+        for training in trainings:
+            dt = timezone.localtime(training.pop("datetime"), tz)
+            training["section_title"] = training.pop("section__title")
+            training["datetime"] = dt.isoformat()
+            days.setdefault(dt.date().isoformat(), []).append(training)
+
+        data = {
+            "date_from": params["date_from"].isoformat(),
+            "date_to": params["date_to"].isoformat(),
+            "timezone": str(tz),
+            "days": [{"date": date, "trainings": items} for date, items in days.items()]
+        }
+        return Response(data, status=200)
+
+
+class CalendarTokenView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        token = calendar_token(request.user)
+        url = request.build_absolute_uri(reverse("calendar-feed", args=[token]))
+        return Response({"token": token, "url": url}, status=200)
+
+
+class CalendarFeedView(GenericAPIView):
+    """Streaming iCalendar feed of student, authorized by token in url"""
+    authentication_classes = ()
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        user = get_calendar_user(token)
+        if user is None:
+            return Response(data={"description": "Календарь не найден", "error": "calendar_not_found"}, status=404)
+
+        feed = StudentCalendar(user)
+        etag, last_modified = feed.get_version()
+        etag = quote_etag(etag)
+        last_modified = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        if isinstance(request._request, ASGIRequest):
+            # ASGI handler iterates streaming response in event loop, where
+            # queries are not allowed, so feed is built here in view's thread
+            response = HttpResponse("".join(feed), content_type="text/calendar; charset=utf-8")
+        else:
+            response = StreamingHttpResponse(feed, content_type="text/calendar; charset=utf-8")
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
 
-        serializer = self.serializer_class(trainings, many=True)
-        return Response(serializer.data, status=200)
 
 class SectionTrainingView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
@@ -261,35 +432,56 @@ class SectionTrainingView(RetrieveAPIView):
                 data={"description": f"Тренировка: {pk} не найдена",
                       "error": "training_not_found"}
             )
-        serializer = self.serializer_class(training)
+        serializer = self.serializer_class(training, context=self.get_serializer_context())
         return Response(serializer.data, status=200)
 
 
 class TrainingMemberCreateView(GenericAPIView):
+    """Check-in to training by QR code. Repeated check-ins are no-op,
+    so the view does one indexed lookup and one insert"""
     permission_classes = [IsAuthenticated]
-    queryset = SectionTraining.objects.all()
-    serializer_class = TrainingMemberSerializer
-    lookup_field = "uuid"
+    queryset = SectionTraining
 
     def get(self, request, uuid):
-        training = self.get_object()
+        is_member = TrainingMember.objects.filter(training=OuterRef("pk"), user=request.user.id)
+        training = (
+            self.queryset.objects
+            .filter(uuid=uuid)
+            .annotate(is_member=Exists(is_member))
+            .values_list("id", "datetime", "is_member")
+            .first()
+        )
+        if training is None:
+            return Response(
+                data={"description": f"Тренировка: {uuid} не найдена",
+                      "error": "training_not_found"},
+                status=404)
+        training_id, training_datetime, is_member = training
 
-        data = request.data.copy()
-        data["user"] = request.user.id
-        data["training"] = training.id
+        if request.user.is_trainer:
+            return Response(
+                data={"description": "Тренер не может быть участником тренировки",
+                      "error": "user_is_trainer"},
+                status=400)
 
-        if training.datetime < timezone.now():
-            timedelta = timezone.now() - training.datetime
+        if training_datetime < timezone.now():
+            timedelta = timezone.now() - training_datetime
             diff_hours = timedelta.total_seconds() // 60 // 60
             if diff_hours >= 3:
                 return Response({"error": "Запись на тренировку уже закрыта!"})
 
-        serializer = self.serializer_class(data=data)
-        if serializer.is_valid(raise_exception=False):
-            serializer.save()
-            return Response(serializer.data, status=201)
-        else:
-            return Response(serializer.errors, status=400)
+        # Repeated scans change nothing, so they are not written to the journal
+        if is_member:
+            return Response({"training": training_id, "user": request.user.id}, status=201)
+        with transaction.atomic():
+            try:
+                # Savepoint keeps transaction usable when concurrent scan inserted the row first
+                with transaction.atomic():
+                    TrainingMember.objects.create(training_id=training_id, user_id=request.user.id)
+            except IntegrityError:
+                return Response({"training": training_id, "user": request.user.id}, status=201)
+            record_changes("add", [request.user.id], training=training_id)
+        return Response({"training": training_id, "user": request.user.id}, status=201)
 
 
 class TrainingMemberDeleteView(GenericAPIView):
@@ -301,6 +493,7 @@ class TrainingMemberDeleteView(GenericAPIView):
         try:
             member = self.queryset.objects.get(training_id=pk, user_id=user_id)
             member.delete()
+            record_changes("remove", [member.user_id], training=pk)
         except SectionMember.DoesNotExist:
             return Response(
                 data={"description": f"Участник: {user_id}, Тренировки: {pk} не найден!", 
@@ -309,29 +502,174 @@ class TrainingMemberDeleteView(GenericAPIView):
             )
 
 
+class RosterView(GenericAPIView):
+    """Apply diff of members list in one transaction and return final list.
+    Subclasses define model of members and their parent. Members are
+    changed only by trainers of section of the parent"""
+    permission_classes = [IsAuthenticated, IsTrainer]
+    serializer_class = RosterSerializer
+    parent_model = None
+    member_model = None
+    parent_field = None
+    roster_lookup = None
+    trainers_lookup = "section__trainers"
+
+    def on_changed(self, pk, added, removed):
+        pass
+
+    def post(self, request, pk):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid(raise_exception=False):
+            return Response(serializer.errors, status=400)
+        add, remove = set(serializer.validated_data["add"]), set(serializer.validated_data["remove"])
+
+        if not self.parent_model.objects.filter(pk=pk).exists():
+            return Response(
+                data={"description": f"{self.parent_model._meta.verbose_name}: {pk} не найдено",
+                      "error": f"{self.parent_field}_not_found"},
+                status=404)
+        if not self.parent_model.objects.filter(pk=pk, **{self.trainers_lookup: request.user.pk}).exists():
+            return Response(
+                data={"description": "Тренер может изменять участников только своих секций",
+                      "error": "forbidden"},
+                status=403)
+
+        students = set(Student.objects.filter(id__in=add).values_list("id", flat=True))
+        if add - students:
+            return Response(
+                data={"description": f"Студенты: {sorted(add - students)} не найдены",
+                      "error": "students_not_found"},
+                status=400)
+
+        members = self.member_model.objects.filter(**{self.parent_field: pk})
+        with transaction.atomic():
+            added = add - set(members.filter(user__in=add).values_list("user", flat=True))
+            self.member_model.objects.bulk_create(
+                [self.member_model(**{f"{self.parent_field}_id": pk, "user_id": user}) for user in added],
+                ignore_conflicts=True
+            )
+            removed = set(members.filter(user__in=remove).values_list("user", flat=True)) if remove else set()
+            if removed:
+                members.filter(user__in=removed).delete()
+            self.on_changed(pk, added, removed)
+
+        roster = Student.objects.filter(**{self.roster_lookup: pk}).only(*StudentSerializer.Meta.fields).order_by("id")
+        data = StudentSerializer(roster, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=200)
+
+
+class TrainingRosterView(RosterView):
+    parent_model = SectionTraining
+    member_model = TrainingMember
+    parent_field = "training"
+    roster_lookup = "trainings"
+
+    def on_changed(self, pk, added, removed):
+        record_changes("add", added, training=pk)
+        record_changes("remove", removed, training=pk)
+        transaction.on_commit(lambda: invalidate("sections_detail"))
+
+
+class EventRosterView(RosterView):
+    parent_model = SectionEvent
+    member_model = EventMember
+    parent_field = "event"
+    roster_lookup = "events"
+
+    def on_changed(self, pk, added, removed):
+        record_changes("add", added, event=pk)
+        record_changes("remove", removed, event=pk)
+
+
+class SectionRosterView(RosterView):
+    parent_model = Section
+    member_model = SectionMember
+    parent_field = "section"
+    roster_lookup = "member_sections"
+    trainers_lookup = "trainers"
+
+    def on_changed(self, pk, added, removed):
+        # bulk_create skips post_save, so new members are put on board here
+        board = Leaderboard(pk)
+        transaction.on_commit(lambda: board.update({user: 0 for user in added}))
+        transaction.on_commit(lambda: invalidate("sections", "sections_detail", "trainers"))
+
+
+class AttendanceSyncView(GenericAPIView):
+    """Offline sync of trainer app: applies batch of attendance operations
+    and returns changes of members made since client cursor"""
+    permission_classes = [IsAuthenticated, IsTrainer]
+    serializer_class = AttendanceSyncSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid(raise_exception=False):
+            return Response(serializer.errors, status=400)
+        data = sync(request.user, serializer.validated_data["operations"], serializer.validated_data["cursor"])
+        return Response(data, status=200)
+
+
+class ChangesView(GenericAPIView):
+    """Sections, trainings, events and their members changed since cursor.
+    Client repeats request with returned cursor while `has_more` is true"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = ChangesSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.query_params)
+        if not serializer.is_valid(raise_exception=False):
+            return Response(serializer.errors, status=400)
+        positions = None
+        if "cursor" in serializer.validated_data:
+            try:
+                positions = decode_cursor(serializer.validated_data["cursor"])
+            except ValueError:
+                return Response(data={"description": "Некорректный курсор", "error": "invalid_cursor"}, status=400)
+        elif "since" in serializer.validated_data:
+            positions = since_positions(serializer.validated_data["since"])
+        data = changes(positions, context=self.get_serializer_context())
+        return Response(data, status=200)
+
+
 class SectionEventListView(ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = SectionEvent
     serializer_class = SectionEventSerializer
+    pagination_class = DatetimeCursorPagination
+    filter_backends = [SerializerFilterBackend]
+    filter_serializer_class = SectionEventFilterSerializer
+
+    @method_decorator(condition(etag_func=events_etag))
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        try:
-            events = self.queryset.objects.all()
-            for key, value in request.data.items():
-                if value:
-                    events = events.filter(**{key: value})
-                    events = events.order_by('datetime')
-            serializer = self.serializer_class(events, many=True)
-            return Response(serializer.data, status=200)
-        except SectionEvent.DoesNotExist:
-            return Response(
-                data={"desctiption": "Мероприятия не найдены", 
-                      "error": "events_not_found"},
-                status=404)
+        return self.list(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        events = self.filter_queryset(self.queryset.objects.all())
+        events = self.serializer_class.setup_eager_loading(events)
+        page = self.paginate_queryset(events)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class EventMemberListView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    queryset = Student
+    serializer_class = StudentSerializer
+    pagination_class = CursorPagination
+
+    @method_decorator(condition(etag_func=event_members_etag))
+    def get(self, request, pk):
+        students = self.queryset.objects.filter(events=pk).only(*self.serializer_class.Meta.fields)
+        page = self.paginate_queryset(students)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
 class EventMemberCreateView(CreateAPIView):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = [IsAuthenticated]
     queryset = EventMember
     serializer_class = EventMemberSerializer
@@ -355,7 +693,8 @@ class EventMemberCreateView(CreateAPIView):
             )
         serializer = self.serializer_class(data=data)
         if serializer.is_valid(raise_exception=False):
-            serializer.save()
+            member = serializer.save()
+            record_changes("add", [member.user_id], event=member.event_id)
             return Response(serializer.data, status=201)
         else:
             return Response(serializer.errors, status=400)
@@ -372,6 +711,7 @@ class EventMemberDeleteView(GenericAPIView):
         try:
             member = self.queryset.objects.get(event_id=event_id, user_id=user_id)
             member.delete()
+            record_changes("remove", [member.user_id], event=member.event_id)
         except SectionMember.DoesNotExist:
             return Response(
                 data={"description": f"Участник: {user_id}, Мероприятия: {event_id} не найден!", 
@@ -382,13 +722,14 @@ class EventMemberDeleteView(GenericAPIView):
 
 class LoginAPI(KnoxLoginView):
     permission_classes = (AllowAny,)
+    throttle_classes = [LoginThrottle]
     serializer_class = LoginSerializer
 
     def post(self, request):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
-        user = serializer.validated_data
-        login(request, user)
+        # Token is the only credential of API, so no session is created
+        request.user = serializer.validated_data
         return super(LoginAPI, self).post(request)
 
     def get_post_response_data(self, request, token, instance):
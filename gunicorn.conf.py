@@ -0,0 +1,14 @@
+import os
+
+# Serving mode is selected by SERVER_MODE env variable, same as in settings
+SERVER_MODE = os.getenv("SERVER_MODE", default="wsgi")
+
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_WORKERS", default=1))
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "sporthack.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "sporthack.wsgi:application"
+    worker_class = "sync"
@@ -1,6 +1,11 @@
+import functools
 import os
+import threading
 
 from celery import Celery
+from celery.signals import task_prerun, worker_process_init
+from celery.utils.log import get_logger
+from redis.exceptions import LockError
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sporthack.settings")
@@ -15,3 +20,70 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
+
+logger = get_logger(__name__)
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    from . import db
+    db.role = "celery"
+
+
+@task_prerun.connect
+def on_task_prerun(**kwargs):
+    # Celery closes connections older than CONN_MAX_AGE before tasks,
+    # broken persistent connections are closed here
+    from .db import check_connections
+    check_connections("tasks")
+
+
+def singleton(lease=60):
+    """Run decorated task at most once at a time across all workers.
+
+    Lock is kept in redis with `lease` seconds timeout and is extended
+    by heartbeat thread while task is running, so lock of crashed worker
+    expires by itself. Calls with other arguments are locked separately.
+    Skipped runs return None and are counted in `celery:singleton:stats`."""
+
+    def decorator(func):
+        name = f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            from .redis_client import get_redis
+
+            redis = get_redis()
+            key = ":".join([name, *map(str, args), *(f"{k}={v}" for k, v in sorted(kwargs.items()))])
+            lock = redis.lock(f"celery:singleton:{key}", timeout=lease, thread_local=False)
+            if not lock.acquire(blocking=False):
+                redis.hincrby("celery:singleton:stats", f"{name}:contended", 1)
+                logger.info(f"Task {key} is already running, skipped")
+                return None
+
+            redis.hincrby("celery:singleton:stats", f"{name}:acquired", 1)
+            stop = threading.Event()
+
+            def heartbeat():
+                while not stop.wait(lease / 3):
+                    try:
+                        lock.reacquire()
+                    except LockError:
+                        logger.warning(f"Lock of task {key} is lost")
+                        return
+
+            thread = threading.Thread(target=heartbeat, daemon=True)
+            thread.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stop.set()
+                thread.join()
+                try:
+                    lock.release()
+                except LockError:
+                    pass
+
+        return wrapper
+
+    return decorator
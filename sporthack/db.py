@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+STATS_KEY = "db:connections:stats"
+FLUSH_INTERVAL = 60
+
+# Process role in stats, worker processes of celery set it to "celery"
+role = "web"
+
+_counters = Counter()
+_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def count(event, value=1):
+    """Count event of process and flush counters to redis once per
+    FLUSH_INTERVAL, so metrics do not cost a redis call per request"""
+    global _flushed_at
+    with _lock:
+        _counters[event] += value
+        if time.monotonic() - _flushed_at < FLUSH_INTERVAL:
+            return
+        counters = dict(_counters)
+        _counters.clear()
+        _flushed_at = time.monotonic()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for name, value in counters.items():
+            pipe.hincrby(STATS_KEY, f"{role}:{name}", value)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def stats():
+    """Opened connections, health check failures and served requests
+    (tasks for celery) by role. Opened per served close to 1 means
+    connections are not reused"""
+    return get_redis().hgetall(STATS_KEY)
+
+
+def check_connections(event):
+    """Close persistent connections, which were broken while idle
+    (restart of database or pooler, idle timeout), before they are used.
+
+    Only connections idle for DB_CONN_HEALTH_CHECK_INTERVAL are checked, so
+    busy processes do not send extra query per request. Connections broken
+    while in use are closed by Django after request, as errors occurred on them"""
+    count(event)
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        used_at, connection.used_at = getattr(connection, "used_at", now), now
+        if now - used_at >= settings.DB_CONN_HEALTH_CHECK_INTERVAL and not connection.is_usable():
+            connection.close()
+            count("unusable")
+
+
+@receiver(connection_created)
+def on_connection_created(sender, connection, **kwargs):
+    connection.used_at = time.monotonic()
+    count("opened")
+
+
+@receiver(request_started)
+def on_request_started(sender, **kwargs):
+    check_connections("requests")
@@ -0,0 +1,17 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Return shared redis client for settings.REDIS_URL"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=1,
+            socket_connect_timeout=1,
+        )
+    return _client
@@ -13,6 +13,7 @@ ALLOWED_HOSTS = ['*']
 
 # Custom settings
 SITE_DOMAIN = os.getenv("SITE_DOMAIN")
+IMAGE_REPRESENTATION = os.getenv("IMAGE_REPRESENTATION", default="base64") # Default for requests without `images` param: url, base64 or none
 
 # Application definition
 
@@ -71,16 +72,29 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'sporthack.wsgi.application'
 
+# wsgi: sync gunicorn workers, asgi: uvicorn workers with async read views
+SERVER_MODE = os.getenv("SERVER_MODE", default="wsgi")
+
 # Database
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds. Under ASGI Django
+# can not reuse them safely, so there pooling by pgbouncer should be used.
+# DB_POOL_MODE=pgbouncer connects to pgbouncer with transaction pooling,
+# which can not keep server side cursors between transactions
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", default="")
+DB_CONN_HEALTH_CHECKS = bool(int(os.getenv("DB_CONN_HEALTH_CHECKS", default=1)))
+DB_CONN_HEALTH_CHECK_INTERVAL = int(os.getenv("DB_CONN_HEALTH_CHECK_INTERVAL", default=30))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv("DB_NAME"),
         'USER': os.getenv("DB_USER"),
         'PASSWORD': os.getenv("DB_PASSWORD"),
-        'HOST': os.getenv("DB_HOST"),
-        'PORT': os.getenv("DB_PORT"),
+        'HOST': os.getenv("DB_POOL_HOST", default="pgbouncer") if DB_POOL_MODE == "pgbouncer" else os.getenv("DB_HOST"),
+        'PORT': os.getenv("DB_POOL_PORT", default="6432") if DB_POOL_MODE == "pgbouncer" else os.getenv("DB_PORT"),
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", default=0 if SERVER_MODE == "asgi" and not DB_POOL_MODE else 60)),
+        'DISABLE_SERVER_SIDE_CURSORS': DB_POOL_MODE == "pgbouncer",
     }
 }
 
@@ -121,8 +135,12 @@ DJOSER = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'knox.auth.TokenAuthentication',
-    ]
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CursorPagination',
+    'PAGE_SIZE': int(os.getenv("API_PAGE_SIZE", default=50)),
+    # Client address is taken from X-Forwarded-For set by nginx
+    'NUM_PROXIES': 1,
 }
 
 REST_KNOX = {
@@ -134,6 +152,35 @@ REST_KNOX = {
   'AUTO_REFRESH': True
 }
 
+# Verified knox tokens are cached in process for LOCAL_TTL seconds and
+# in redis for REDIS_TTL seconds. Logout evicts token from redis and cache
+# of its process, other processes drop it after LOCAL_TTL
+AUTH_TOKEN_CACHE = {
+    'LOCAL_SIZE': 1024,
+    'LOCAL_TTL': 5,
+    'REDIS_TTL': 300,
+}
+
+# Password hashing of login runs in pool of WORKERS threads, at most QUEUE
+# logins wait for it, others and ones waiting longer than TIMEOUT seconds get 503
+LOGIN_HASHING = {
+    'WORKERS': int(os.getenv("LOGIN_HASHING_WORKERS", default=4)),
+    'QUEUE': int(os.getenv("LOGIN_HASHING_QUEUE", default=16)),
+    'TIMEOUT': 5,
+}
+
+# Failed login attempts per IP and per account: (limit, window in seconds)
+LOGIN_RATE_LIMITS = {
+    'ip': (
+        int(os.getenv("LOGIN_IP_LIMIT", default=30)),
+        int(os.getenv("LOGIN_IP_WINDOW", default=60)),
+    ),
+    'account': (
+        int(os.getenv("LOGIN_ACCOUNT_LIMIT", default=5)),
+        int(os.getenv("LOGIN_ACCOUNT_WINDOW", default=15 * 60)),
+    ),
+}
+
 # PhoneNumber settings
 PHONENUMBER_DB_FORMAT = 'NATIONAL'
 PHONENUMBER_DEFAULT_FORMAT = 'NATIONAL'
@@ -157,23 +204,71 @@ USE_I18N = True
 USE_L10N = True
 USE_TZ = True
 
+# Redis
+REDIS_URL = os.getenv("REDIS_URL", default="redis://redis:6379")
+
 # Celery
 CELERY_TIMEZONE = "Europe/Moscow"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
-CELERY_BROKER_URL = "redis://redis:6379"
-CELERY_RESULT_BACKEND = "redis://redis:6379"
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "KEY_PREFIX": "sporthack",
+    }
+}
+
+# Cached responses are invalidated by signals, timeout only bounds staleness
+# of changes made without signals (bulk inserts of training members, profiles)
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", default=60))
+
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
+# ETA tasks are kept unacknowledged until their time,
+# so visibility timeout must be longer than SETTLEMENT_HORIZON
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 3 * 60 * 60}
+
+# Trainings and events are settled by tasks scheduled at their datetime,
+# only those inside horizon are scheduled
+SETTLEMENT_HORIZON = timedelta(hours=1)
+
+# Deleted objects are reported to syncing clients during this period
+TOMBSTONE_TTL = timedelta(days=30)
+
+# Journal of attendance changes is kept for offline clients during this period
+ATTENDANCE_CHANGES_TTL = timedelta(days=30)
 
 # Celery periodic tasks
 
 CELERY_BEAT_SCHEDULE = {
-    "update_trainigs": {
-        "task": "api.tasks.update_trainings",
-        "schedule": crontab(minute="*/5"),
+    "sweep_settlements": {
+        "task": "api.tasks.sweep_settlements",
+        "schedule": crontab(minute="*/15"),
+    },
+    "send_outbox_emails": {
+        "task": "api.tasks.send_outbox_emails",
+        "schedule": crontab(minute="*"),
+    },
+    "rebuild_leaderboards": {
+        "task": "api.tasks.rebuild_leaderboards",
+        "schedule": crontab(minute=0, hour=4),
+    },
+    "purge_tombstones": {
+        "task": "api.tasks.purge_tombstones",
+        "schedule": crontab(minute=30, hour=4),
+    },
+    "purge_attendance_changes": {
+        "task": "api.tasks.purge_attendance_changes",
+        "schedule": crontab(minute=45, hour=4),
+    },
+    "flush_token_refreshes": {
+        "task": "api.tasks.flush_token_refreshes",
+        "schedule": crontab(minute="*"),
     },
-    "update_events": {
-        "task": "api.tasks.update_events",
-        "schedule": crontab(minute="*/5"),
+    "purge_expired_auth": {
+        "task": "api.tasks.purge_expired_auth",
+        "schedule": crontab(minute=15),
     }
 }
 